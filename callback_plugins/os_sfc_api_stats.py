@@ -0,0 +1,178 @@
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+DOCUMENTATION = '''
+    callback: os_sfc_api_stats
+    type: aggregate
+    short_description: Aggregate the API cost of the networking-sfc modules.
+    author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+    version_added: "2.5"
+    description:
+      - Collects the API call latencies and retries returned by the
+        os_sfc_port_pair, os_sfc_port_pair_group, os_sfc_flow_classifier and
+        os_sfc_port_chain modules across all hosts and tasks.
+      - At the end of the play, displays the slowest tasks, the number of
+        calls per resource type and the p50/p95 latency of each operation,
+        and writes the same report in a JSON file.
+    requirements:
+      - whitelisting in configuration
+      - the C(api_stats) option of the modules enabled, for instance with
+        module_defaults
+    options:
+      output_file:
+        description: Path of the JSON report.
+        default: sfc_api_stats.json
+        env:
+          - name: SFC_API_STATS_FILE
+        ini:
+          - section: callback_os_sfc_api_stats
+            key: output_file
+      top_tasks:
+        description: Number of slowest tasks in the report.
+        default: 10
+        type: int
+        env:
+          - name: SFC_API_STATS_TOP_TASKS
+        ini:
+          - section: callback_os_sfc_api_stats
+            key: top_tasks
+'''
+
+import json
+import math
+
+from ansible.plugins.callback import CallbackBase
+
+
+_OPERATIONS = ('create', 'delete', 'get', 'list', 'search', 'update')
+
+
+def _resource_type(operation):
+    """Return the resource type of an operation, list_sfc_port_pairs -> port_pair.
+
+    Bulk operations, such as create_sfc_flow_classifiers, use the plural.
+    """
+    words = operation.split('_')
+    if words[0] in _OPERATIONS:
+        words = words[1:]
+    if words and words[0] == 'sfc':
+        words = words[1:]
+    resource = '_'.join(words)
+    if resource.endswith('s'):
+        resource = resource[:-1]
+    return resource or operation
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'os_sfc_api_stats'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self._tasks = []
+        self._latencies = {}
+        self._retries = {}
+
+    def _collect(self, result):
+        """Return the sfc_api_stats of a task result, its loop items and regions."""
+        stats = []
+        for res in [result] + result.get('results', []):
+            if not isinstance(res, dict):
+                continue
+            if 'sfc_api_stats' in res:
+                stats.append(res['sfc_api_stats'])
+            for region in res.get('regions', []):
+                if 'sfc_api_stats' in region:
+                    stats.append(region['sfc_api_stats'])
+        return stats
+
+    def _record(self, result):
+        stats = self._collect(result._result)
+        if not stats:
+            return
+
+        calls = 0
+        api_time = 0.0
+        retries = 0
+        for entry in stats:
+            for operation, latencies in entry['calls'].items():
+                self._latencies.setdefault(operation, []).extend(latencies)
+                calls += len(latencies)
+                api_time += sum(latencies)
+            for operation, count in entry['retries'].items():
+                self._retries[operation] = self._retries.get(operation, 0) + count
+                retries += count
+
+        self._tasks.append(dict(task=result._task.get_name(),
+                                host=result._host.get_name(),
+                                elapsed=sum(entry['elapsed'] for entry in stats),
+                                api_time=api_time,
+                                calls=calls,
+                                retries=retries))
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    def _report(self):
+        top_tasks = sorted(self._tasks, key=lambda task: task['elapsed'],
+                           reverse=True)[:self.get_option('top_tasks')]
+
+        resources = {}
+        for operation, latencies in self._latencies.items():
+            resource = _resource_type(operation)
+            resources[resource] = resources.get(resource, 0) + len(latencies)
+
+        operations = {}
+        for operation, latencies in self._latencies.items():
+            latencies = sorted(latencies)
+            operations[operation] = dict(count=len(latencies),
+                                         total=sum(latencies),
+                                         p50=_percentile(latencies, 50),
+                                         p95=_percentile(latencies, 95),
+                                         retries=self._retries.get(operation, 0))
+
+        return dict(tasks=len(self._tasks),
+                    top_tasks=top_tasks,
+                    calls_per_resource=resources,
+                    operations=operations)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self._tasks:
+            return
+
+        report = self._report()
+
+        self._display.banner('SFC API STATS')
+        for task in report['top_tasks']:
+            self._display.display(
+                '%s (%s): %.2fs, %d calls in %.2fs, %d retries' %
+                (task['task'], task['host'], task['elapsed'], task['calls'],
+                 task['api_time'], task['retries']))
+        self._display.display('')
+        for resource, count in sorted(report['calls_per_resource'].items()):
+            self._display.display('%s: %d calls' % (resource, count))
+        self._display.display('')
+        for operation, op in sorted(report['operations'].items()):
+            self._display.display(
+                '%s: %d calls, p50 %.3fs, p95 %.3fs, %d retries' %
+                (operation, op['count'], op['p50'], op['p95'], op['retries']))
+
+        output_file = self.get_option('output_file')
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self._display.display('SFC API stats written to %s' % output_file)
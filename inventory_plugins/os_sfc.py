@@ -0,0 +1,204 @@
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+DOCUMENTATION = '''
+    name: os_sfc
+    plugin_type: inventory
+    short_description: OpenStack networking-sfc inventory source
+    author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+    version_added: "2.5"
+    requirements:
+      - shade
+    extends_documentation_fragment:
+      - inventory_cache
+      - constructed
+    description:
+      - Get the servers of the VNF port pairs from OpenStack networking-sfc,
+        grouped by the port chains and the port pair groups they serve.
+      - Port chains, port pair groups, port pairs, ports and servers are
+        fetched with one listing each.
+      - The topology is stored in the inventory cache when caching is
+        enabled, subsequent runs are served from the cache until it expires.
+      - Uses a YAML configuration file that ends with os_sfc.(yml|yaml).
+    options:
+      plugin:
+        description: Token that ensures this is a source file for the 'os_sfc' plugin.
+        required: True
+        choices: ['os_sfc']
+      cloud:
+        description: Name of the cloud in clouds.yaml.
+        env:
+          - name: OS_CLOUD
+      region_name:
+        description: Name of the region.
+        env:
+          - name: OS_REGION_NAME
+      group_prefix:
+        description: Prefix of the names of the groups.
+        default: sfc_
+'''
+
+EXAMPLES = '''
+# os_sfc.yml
+plugin: os_sfc
+cloud: mycloud
+cache: true
+cache_plugin: jsonfile
+cache_connection: /tmp/os_sfc_inventory
+cache_timeout: 600
+keyed_groups:
+  - key: sfc_port_chains
+    prefix: chain
+'''
+
+import re
+
+from ansible.errors import AnsibleError
+from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
+
+try:
+    import shade
+    HAS_SHADE = True
+except ImportError:
+    HAS_SHADE = False
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+
+    NAME = 'os_sfc'
+
+    def verify_file(self, path):
+        if super(InventoryModule, self).verify_file(path):
+            return path.endswith(('os_sfc.yml', 'os_sfc.yaml'))
+        return False
+
+    def _fetch_topology(self):
+        """Fetch the SFC topology, as a cacheable dictionary.
+
+        Port pair groups reference the servers of the ingress and egress
+        ports of their port pairs, port chains reference their port pair
+        groups.
+        """
+        if not HAS_SHADE:
+            raise AnsibleError('shade is required for the os_sfc inventory plugin')
+
+        try:
+            cloud = shade.openstack_cloud(cloud=self.get_option('cloud'),
+                                          region_name=self.get_option('region_name'))
+            pcs = cloud.list_sfc_port_chains()
+            ppgs = cloud.list_sfc_port_pair_groups()
+            pps = cloud.list_sfc_port_pairs()
+            ports = cloud.list_ports()
+            servers = cloud.list_servers()
+        except shade.OpenStackCloudException as e:
+            raise AnsibleError('Cannot fetch the SFC topology: %s' % (e))
+
+        port_devices = dict((port['id'], port['device_id']) for port in ports)
+        pp_servers = {}
+        for pp in pps:
+            pp_servers[pp['id']] = set(port_devices.get(pp[key])
+                                       for key in ('ingress', 'egress'))
+
+        topology = dict(servers={}, port_pair_groups={}, port_chains={})
+        server_ids = set()
+        for ppg in ppgs:
+            ppg_servers = set()
+            for pp_id in ppg['port_pairs']:
+                ppg_servers.update(pp_servers.get(pp_id, ()))
+            ppg_servers.discard(None)
+            ppg_servers.discard('')
+            server_ids.update(ppg_servers)
+            topology['port_pair_groups'][ppg['id']] = dict(
+                name=ppg['name'] or ppg['id'],
+                servers=sorted(ppg_servers))
+
+        for pc in pcs:
+            topology['port_chains'][pc['id']] = dict(
+                name=pc['name'] or pc['id'],
+                port_pair_groups=pc['port_pair_groups'])
+
+        for server in servers:
+            if server['id'] in server_ids:
+                topology['servers'][server['id']] = dict(
+                    name=server['name'],
+                    ansible_host=(server.get('interface_ip') or
+                                  server.get('accessIPv4') or
+                                  server.get('private_v4')))
+
+        return topology
+
+    def _group_name(self, kind, name):
+        name = '%s%s_%s' % (self.get_option('group_prefix'), kind, name)
+        return re.sub(r'[^A-Za-z0-9_]', '_', name)
+
+    def _populate(self, topology):
+        servers = topology['servers']
+        host_vars = dict((server_id, dict(sfc_port_pair_groups=[],
+                                          sfc_port_chains=[]))
+                         for server_id in servers)
+
+        for ppg in topology['port_pair_groups'].values():
+            for server_id in ppg['servers']:
+                if server_id in host_vars:
+                    host_vars[server_id]['sfc_port_pair_groups'].append(ppg['name'])
+
+        for pc in topology['port_chains'].values():
+            for ppg_id in pc['port_pair_groups']:
+                ppg = topology['port_pair_groups'].get(ppg_id)
+                if ppg is None:
+                    continue
+                for server_id in ppg['servers']:
+                    if (server_id in host_vars and
+                            pc['name'] not in host_vars[server_id]['sfc_port_chains']):
+                        host_vars[server_id]['sfc_port_chains'].append(pc['name'])
+
+        strict = self.get_option('strict')
+        for server_id, server in servers.items():
+            host = server['name']
+            self.inventory.add_host(host)
+            variables = dict(host_vars[server_id], sfc_server_id=server_id)
+            if server['ansible_host']:
+                variables['ansible_host'] = server['ansible_host']
+            for key, value in variables.items():
+                self.inventory.set_variable(host, key, value)
+
+            for ppg_name in variables['sfc_port_pair_groups']:
+                group = self._group_name('ppg', ppg_name)
+                self.inventory.add_group(group)
+                self.inventory.add_child(group, host)
+            for pc_name in variables['sfc_port_chains']:
+                group = self._group_name('chain', pc_name)
+                self.inventory.add_group(group)
+                self.inventory.add_child(group, host)
+
+            self._set_composite_vars(self.get_option('compose'), variables, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), variables, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), variables, host, strict=strict)
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache=cache)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        user_cache_setting = self.get_option('cache')
+        attempt_to_read_cache = user_cache_setting and cache
+        cache_needs_update = user_cache_setting and not cache
+
+        topology = None
+        if attempt_to_read_cache:
+            try:
+                topology = self._cache[cache_key]
+            except KeyError:
+                cache_needs_update = True
+
+        if topology is None:
+            topology = self._fetch_topology()
+
+        if cache_needs_update:
+            self._cache[cache_key] = topology
+
+        self._populate(topology)
@@ -0,0 +1,579 @@
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+from ansible.module_utils.openstack import openstack_cloud_from_module
+
+
+SNAPSHOT_FORMAT = 'os-sfc-snapshot'
+SNAPSHOT_VERSION = 1
+
+# Kinds of the snapshot records, in dependency order
+SNAPSHOT_KINDS = ('port', 'port_pair', 'flow_classifier', 'port_pair_group',
+                  'port_chain')
+
+
+def sfc_run_argument_spec():
+    """Options of the modules run through sfc_run."""
+    return dict(
+        api_stats=dict(type='bool', default=False),
+        clouds=dict(type='list', default=None),
+        sfc_profile=dict(type='path', default=None),
+    )
+
+
+def sfc_argument_spec():
+    """Options shared by the networking-sfc resource modules."""
+    spec = sfc_run_argument_spec()
+    spec.update(
+        journal=dict(type='path', default=None),
+        journal_max_age=dict(type='int', default=3600),
+        return_fields=dict(type='list', default=None),
+        return_object=dict(type='bool', default=True),
+    )
+    return spec
+
+
+class SfcModuleExit(Exception):
+    """Result of a module run through a SfcModuleProxy."""
+
+    def __init__(self, result):
+        super(SfcModuleExit, self).__init__(result.get('msg'))
+        self.result = result
+
+
+class SfcModuleProxy(object):
+    """Stand-in for an AnsibleModule with its own parameters.
+
+    exit_json and fail_json raise SfcModuleExit instead of exiting the
+    process, so that the module can be run several times in one process.
+    """
+
+    def __init__(self, module, **params):
+        self.module = module
+        self.params = dict(module.params, **params)
+        self.check_mode = module.check_mode
+
+    def exit_json(self, **kwargs):
+        kwargs.setdefault('changed', False)
+        raise SfcModuleExit(kwargs)
+
+    def fail_json(self, **kwargs):
+        kwargs['failed'] = True
+        raise SfcModuleExit(kwargs)
+
+
+def sfc_cloud_from_module(module):
+    """Connect to the cloud of a module.
+
+    openstack_cloud_from_module consumes the cloud parameter, it is put back
+    as it identifies the cloud in the journal.
+    """
+    cloud_config = module.params.get('cloud')
+    shade, cloud = openstack_cloud_from_module(module)
+    module.params['cloud'] = cloud_config
+    return shade, cloud
+
+
+class SfcApiStats(object):
+    """Latencies and retries of the API calls of a module run."""
+
+    def __init__(self):
+        self.calls = {}
+        self.retries = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, latency):
+        with self._lock:
+            self.calls.setdefault(operation, []).append(round(latency, 6))
+
+    def retry(self, operation):
+        with self._lock:
+            self.retries[operation] = self.retries.get(operation, 0) + 1
+
+    def as_dict(self, elapsed):
+        return dict(elapsed=elapsed, calls=self.calls, retries=self.retries)
+
+
+class SfcInstrumentedCloud(object):
+    """Proxy of a shade cloud recording the latency of its public methods."""
+
+    def __init__(self, cloud, stats):
+        self._cloud = cloud
+        self.sfc_stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self._cloud, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.sfc_stats.record(name, time.time() - start)
+        return _call
+
+
+def sfc_network_call(cloud, operation, method, url, **kwargs):
+    """Call the Neutron REST API of a cloud, for the calls shade lacks.
+
+    The latency of the call is recorded as operation when the cloud is
+    instrumented, like the public methods of the cloud.
+    """
+    start = time.time()
+    try:
+        return getattr(cloud._network_client, method)(url, **kwargs)
+    finally:
+        stats = getattr(cloud, 'sfc_stats', None)
+        if stats is not None:
+            stats.record(operation, time.time() - start)
+
+
+def sfc_count_retry(cloud, operation):
+    """Count a retried API call when the cloud is instrumented."""
+    stats = getattr(cloud, 'sfc_stats', None)
+    if stats is not None:
+        stats.retry(operation)
+
+
+# Profiles of the worker threads while a run is profiled, else None
+_worker_profiles = None
+_worker_profiles_lock = threading.Lock()
+
+
+def _worker_profile():
+    """Profile the calling worker thread when the run is profiled."""
+    with _worker_profiles_lock:
+        if _worker_profiles is None:
+            return None
+        import cProfile
+        profile = cProfile.Profile()
+        _worker_profiles.append(profile)
+    profile.enable()
+    return profile
+
+
+def sfc_map_concurrently(func, items, workers):
+    """Call func on each item with at most workers threads.
+
+    Return the list of (result, exception) of the items, in order.
+    """
+    results = [None] * len(items)
+    pending = list(enumerate(items))
+    lock = threading.Lock()
+
+    def _worker():
+        profile = _worker_profile()
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    index, item = pending.pop(0)
+                try:
+                    results[index] = (func(item), None)
+                except Exception as e:
+                    results[index] = (None, e)
+        finally:
+            if profile is not None:
+                profile.disable()
+
+    threads = [threading.Thread(target=_worker)
+               for i in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def sfc_bulk_create_flow_classifiers(shade, cloud, fcs_kwargs, bulk_size, concurrency):
+    """Create flow classifiers with chunked bulk requests.
+
+    bulk_size and concurrency must be at least 1. Chunks fall back to
+    concurrent single creates when a bulk request fails, bulk requests are
+    not used anymore after a failure.
+    Return the list of (flow classifier, exception) in order.
+    """
+    results = []
+    bulk = bulk_size > 1
+    for i in range(0, len(fcs_kwargs), bulk_size):
+        chunk = fcs_kwargs[i:i + bulk_size]
+        if bulk:
+            try:
+                data = sfc_network_call(
+                    cloud, 'create_sfc_flow_classifiers', 'post',
+                    '/sfc/flow_classifiers.json',
+                    json={'flow_classifiers': chunk},
+                    error_message="Error creating flow classifiers")
+                results.extend((fc, None) for fc in data['flow_classifiers'])
+                continue
+            except shade.OpenStackCloudException:
+                bulk = False
+        results.extend(sfc_map_concurrently(
+            lambda fc_kwargs: cloud.create_sfc_flow_classifier(**fc_kwargs),
+            chunk, concurrency))
+    if len(results) != len(fcs_kwargs):
+        raise shade.OpenStackCloudException(
+            "Created %d flow classifiers instead of %d" % (len(results), len(fcs_kwargs)))
+    return results
+
+
+def _reconcile_in_cloud(module, reconcile, target, debug_logging=False):
+    """Reconcile the module in one cloud and return the result.
+
+    reconcile(module, shade, cloud) is called with a SfcModuleProxy using the
+    target parameters.
+    """
+    start = time.time()
+    proxy = SfcModuleProxy(module, **target)
+    stats = None
+    if module.params['api_stats']:
+        stats = SfcApiStats()
+    try:
+        shade, cloud = sfc_cloud_from_module(proxy)
+        if debug_logging:
+            shade.simple_logging(debug=True)
+        if stats is not None:
+            cloud = SfcInstrumentedCloud(cloud, stats)
+        reconcile(proxy, shade, cloud)
+        result = dict(changed=False)
+    except SfcModuleExit as e:
+        result = e.result
+    except Exception as e:
+        result = dict(failed=True, msg=str(e))
+    if stats is not None:
+        result['sfc_api_stats'] = stats.as_dict(time.time() - start)
+    return result
+
+
+def _fan_out(module, reconcile):
+    """Reconcile the module in each of its clouds, concurrently."""
+    targets = []
+    for target in module.params['clouds']:
+        if not isinstance(target, dict):
+            target = dict(cloud=target)
+        targets.append(dict(cloud=target.get('cloud', module.params['cloud']),
+                            region_name=target.get('region_name',
+                                                   module.params['region_name'])))
+
+    def _run(target):
+        start = time.time()
+        result = _reconcile_in_cloud(module, reconcile, target)
+        result.update(target)
+        result['elapsed'] = time.time() - start
+        return result
+
+    start = time.time()
+    results = [result for result, e in
+               sfc_map_concurrently(_run, targets, len(targets))]
+
+    result = dict(changed=any(r.get('changed') for r in results),
+                  regions=results,
+                  elapsed=time.time() - start)
+    failed = ['%s/%s: %s' % (r['cloud'], r['region_name'], r['msg'])
+              for r in results if r.get('failed')]
+    if failed:
+        result['failed'] = True
+        result['msg'] = '; '.join(failed)
+    return result
+
+
+def _profile_summary(stats, elapsed):
+    """Split the profiled time into imports, API calls and diffing.
+
+    The cumulative time of a recursive function only counts its outermost
+    calls, nested imports are only counted once by _find_and_load. Python 2
+    has no _find_and_load, __import__ is used instead.
+    """
+    summary = dict(elapsed=elapsed, imports=0.0, api_calls=0.0, diffing=0.0)
+    find_and_load = builtin_import = 0.0
+    session = os.path.join('keystoneauth1', 'session.py')
+    for (filename, lineno, funcname), stat in stats.stats.items():
+        cumulative = stat[3]
+        if funcname == '_find_and_load':
+            find_and_load += cumulative
+        elif '__import__' in funcname:
+            builtin_import += cumulative
+        elif funcname == 'request' and filename.endswith(session):
+            summary['api_calls'] += cumulative
+        elif funcname in ('_needs_update', '_system_state_change'):
+            summary['diffing'] += cumulative
+    summary['imports'] = find_and_load or builtin_import
+    summary['other'] = max(0.0, elapsed - (summary['imports'] +
+                                           summary['api_calls'] +
+                                           summary['diffing']))
+    return summary
+
+
+def _profiled(module, func):
+    """Call func under cProfile and tracemalloc when profiling is enabled.
+
+    The stats are written in the directory given by the sfc_profile option
+    or the OS_SFC_PROFILE_DIR environment variable: the cProfile stats in a
+    .prof file, and a .json summary with the time spent in imports, API
+    calls and diffing and the top allocations.
+    The threads of sfc_map_concurrently are profiled too, their times are
+    summed, so the summary of a concurrent run can exceed its elapsed time.
+    """
+    global _worker_profiles
+    directory = module.params.get('sfc_profile') or os.environ.get('OS_SFC_PROFILE_DIR')
+    if not directory:
+        return func()
+
+    import cProfile
+    import pstats
+    try:
+        import tracemalloc
+    except ImportError:
+        # Python 2
+        tracemalloc = None
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    prefix = os.path.join(directory, '%s-%d-%d' % (getattr(module, '_name', 'os_sfc'),
+                                                   time.time(), os.getpid()))
+
+    profile = cProfile.Profile()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    with _worker_profiles_lock:
+        _worker_profiles = []
+    profile.enable()
+    try:
+        result = func()
+    finally:
+        profile.disable()
+        with _worker_profiles_lock:
+            worker_profiles, _worker_profiles = _worker_profiles, None
+        stats = pstats.Stats(profile)
+        for worker_profile in worker_profiles:
+            stats.add(worker_profile)
+        summary = _profile_summary(stats, time.time() - start)
+        stats.dump_stats(prefix + '.prof')
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            summary['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            summary['top_allocations'] = [
+                dict(location=str(stat.traceback), size=stat.size, count=stat.count)
+                for stat in snapshot.statistics('lineno')[:25]]
+        with open(prefix + '.json', 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    result['sfc_profile'] = prefix
+    return result
+
+
+def sfc_run(module, reconcile):
+    """Reconcile the module in its cloud, or each of its clouds, and exit.
+
+    Each cloud is reconciled in its own thread with its own connection.
+    """
+    if module.params.get('clouds'):
+        result = _profiled(module, lambda: _fan_out(module, reconcile))
+    else:
+        result = _profiled(module, lambda: _reconcile_in_cloud(
+            module, reconcile, {}, debug_logging=True))
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+def sfc_result(module, changed, kind, resource, **kwargs):
+    """Build the result of a module for a resource.
+
+    The resource is trimmed to return_fields, or left out of the result when
+    return_object is false. Its UUID is always returned.
+    """
+    result = dict(changed=changed, id=resource['id'], **kwargs)
+    if module.params['return_object']:
+        fields = module.params['return_fields']
+        if fields:
+            resource = dict((key, resource[key]) for key in fields
+                            if key in resource)
+        result[kind] = resource
+    return result
+
+
+def journal_spec_hash(module, keys):
+    """Hash the requested specification of a resource."""
+    spec = dict((key, module.params[key]) for key in keys)
+    data = json.dumps(spec, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def _journal_key(module, kind, name):
+    cloud = module.params.get('cloud')
+    if isinstance(cloud, dict):
+        # Hash the cloud configuration, it holds credentials
+        data = json.dumps(cloud, sort_keys=True)
+        cloud = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    return (kind, name, cloud, module.params.get('region_name'))
+
+
+# Last entry of each resource, by journal path, loaded once per process
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def _journal_entries(path, max_age=None):
+    """Load the last entry of each resource from the journal.
+
+    The journal is compacted on load: it is rewritten without the superseded
+    entries and the entries older than max_age seconds, so that it doesn't
+    grow with each run.
+    """
+    with _journals_lock:
+        if path not in _journals:
+            entries = {}
+            if os.path.exists(path):
+                with open(path, 'r+') as f:
+                    # Concurrent forks append to and compact the same journal
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    lines = 0
+                    for line in f:
+                        lines += 1
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Truncated line from an interrupted run
+                            continue
+                        entries[(record['kind'], record['name'], record['cloud'],
+                                 record['region_name'])] = record
+                    if max_age is not None:
+                        expiry = time.time() - max_age
+                        entries = dict((key, record) for key, record in entries.items()
+                                       if record['time'] >= expiry)
+                    if len(entries) != lines:
+                        f.seek(0)
+                        f.truncate()
+                        for record in sorted(entries.values(), key=lambda r: r['time']):
+                            f.write(json.dumps(record, sort_keys=True) + '\n')
+                        f.flush()
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            _journals[path] = entries
+        return _journals[path]
+
+
+def journal_lookup(module, kind, name):
+    """Return the last journal entry of a resource, or None.
+
+    Entries older than journal_max_age seconds are ignored, so that the
+    changes made out of band are eventually corrected.
+    """
+    path = module.params['journal']
+    if not path or not name:
+        return None
+
+    max_age = module.params.get('journal_max_age')
+    entry = _journal_entries(path, max_age).get(_journal_key(module, kind, name))
+    if entry is None or (max_age is not None and
+                         entry['time'] < time.time() - max_age):
+        return None
+    return entry
+
+
+def journal_is_converged(module, kind, resource, spec_hash):
+    """Check that the journal recorded the resource with the same spec."""
+    if not resource:
+        return False
+    entry = journal_lookup(module, kind, resource['name'])
+    return (entry is not None and
+            entry['action'] != 'delete' and
+            entry['id'] == resource['id'] and
+            entry['spec_hash'] == spec_hash)
+
+
+def journal_record(module, kind, name, action, resource_id, spec_hash=None):
+    """Append a completed action on a resource to the journal."""
+    path = module.params['journal']
+    if not path or not name:
+        return
+
+    key = _journal_key(module, kind, name)
+    record = dict(kind=kind, name=name, action=action, id=resource_id,
+                  spec_hash=spec_hash, cloud=key[2], region_name=key[3],
+                  time=time.time())
+    with open(path, 'a') as f:
+        # Concurrent forks append to the same journal
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    with _journals_lock:
+        if path in _journals:
+            _journals[path][key] = record
+
+
+def snapshot_dumps(record):
+    """Serialize a snapshot record as a compact JSON line."""
+    record = dict((key, value) for key, value in record.items()
+                  if value is not None and value != '')
+    return json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def snapshot_header():
+    return snapshot_dumps(dict(format=SNAPSHOT_FORMAT,
+                               version=SNAPSHOT_VERSION))
+
+
+def snapshot_refs(resources):
+    """Map the UUIDs of resources to their snapshot references.
+
+    Resources are referenced by name, or by UUID when their name is empty or
+    not unique.
+    """
+    names = {}
+    for resource in resources:
+        if resource.get('name'):
+            names[resource['name']] = names.get(resource['name'], 0) + 1
+
+    refs = {}
+    for resource in resources:
+        if resource.get('name') and names[resource['name']] == 1:
+            refs[resource['id']] = resource['name']
+        else:
+            refs[resource['id']] = resource['id']
+    return refs
+
+
+def snapshot_read(path):
+    """Iterate over the records of a snapshot file, without its header."""
+    with open(path) as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError("%s is not a SFC snapshot" % (path))
+        if header.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported SFC snapshot version %s in %s" %
+                             (header.get('version'), path))
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def snapshot_load(path):
+    """Load a snapshot, indexing its records by kind and reference."""
+    records = dict((kind, []) for kind in SNAPSHOT_KINDS)
+    for record in snapshot_read(path):
+        records[record['kind']].append(record)
+
+    topology = {}
+    for kind, kind_records in records.items():
+        refs = snapshot_refs(kind_records)
+        topology[kind] = dict((refs[record['id']], record)
+                              for record in kind_records)
+    return topology
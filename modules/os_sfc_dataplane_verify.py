@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: os_sfc_dataplane_verify
+short_description: Verify the networking-sfc data plane from ovs-ofctl flow dumps.
+author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+version_added: "2.5"
+description:
+  - Check offline that the compute nodes programmed the port chains of a
+    snapshot written by os_sfc_snapshot_export, from the output of
+    C(ovs-ofctl dump-flows) collected on each node.
+  - The dumps are read line by line, only the distinct chain path and
+    service index pairs found on each node are kept in memory, whatever the
+    number of flows. Dumps ending with .gz are decompressed on the fly.
+  - For each port chain, the hop delivering the traffic to a port pair
+    group is expected on every node hosting the ingress port of one of its
+    port pairs, with the C(chain_id) of the chain as path ID (MPLS label
+    C(chain_id << 8 | index) or NSH SPI) and a service index starting at 255
+    for the first hop. The classifiers are expected on the node of their
+    logical source port, as a flow matching their IP prefixes and protocol
+    and encapsulating with the first hop of the chain.
+  - Path IDs that don't belong to any chain of the snapshot, or service
+    indexes beyond the last hop of their chain, are reported as stale.
+options:
+  snapshot:
+    description:
+      - Path of a snapshot written by os_sfc_snapshot_export.
+    required: true
+  dumps:
+    description:
+      - Dictionary mapping the compute nodes to the path of their
+        C(ovs-ofctl dump-flows) output.
+    required: true
+'''
+
+EXAMPLES = '''
+# Verify the data plane of two compute nodes
+- os_sfc_dataplane_verify:
+    snapshot: /var/backups/sfc.jsonl
+    dumps:
+      compute-1: /tmp/flows/compute-1.txt
+      compute-2: /tmp/flows/compute-2.txt.gz
+  register: verify
+  failed_when: verify.missing_hops or verify.missing_classifiers
+'''
+
+RETURN = '''
+port_chains:
+    description: Result of each port chain, with its C(chain_id), its
+                 C(missing_hops) and its C(missing_classifiers).
+    returned: success
+    type: dict
+missing_hops:
+    description: Number of hops missing on the compute nodes.
+    returned: success
+    type: int
+missing_classifiers:
+    description: Number of flow classifiers missing on the compute nodes.
+    returned: success
+    type: int
+stale:
+    description: Dictionary mapping the compute nodes to the list of
+                 [path ID, service index] pairs that match no chain hop.
+    returned: success
+    type: dict
+unverified_hosts:
+    description: Compute nodes hosting SFC ports without a flow dump.
+    returned: success
+    type: list
+'''
+
+import gzip
+import io
+import re
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.os_sfc import snapshot_load
+
+
+FIRST_SERVICE_INDEX = 255
+
+_NUMBER = r'(0x[0-9a-fA-F]+|\d+)'
+_MPLS_LABEL_RES = [re.compile(r'mpls_label=' + _NUMBER),
+                   re.compile(r'set_mpls_label\(' + _NUMBER + r'\)'),
+                   re.compile(r'set_field:' + _NUMBER + r'->mpls_label'),
+                   re.compile(r'load:' + _NUMBER + r'->OXM_OF_MPLS_LABEL')]
+_NSH_SPI_RES = [re.compile(r'\bnsh_spi=' + _NUMBER),
+                re.compile(r'\bnsp=' + _NUMBER),
+                re.compile(r'set_field:' + _NUMBER + r'->nsh_spi')]
+_NSH_SI_RES = [re.compile(r'\bnsh_si=' + _NUMBER),
+               re.compile(r'\bnsi=' + _NUMBER),
+               re.compile(r'set_field:' + _NUMBER + r'->nsh_si')]
+_ENCAP_ACTIONS = ('push_mpls', 'push_nsh', 'encap(nsh')
+
+
+def _find_numbers(regexps, line):
+    numbers = []
+    for regexp in regexps:
+        numbers.extend(int(value, 0) for value in regexp.findall(line))
+    return numbers
+
+
+def flow_paths(line):
+    """Return the set of (path ID, service index) pairs of a flow line."""
+    paths = set()
+    for label in _find_numbers(_MPLS_LABEL_RES, line):
+        paths.add((label >> 8, label & 0xff))
+    spis = _find_numbers(_NSH_SPI_RES, line)
+    sis = _find_numbers(_NSH_SI_RES, line)
+    for spi, si in zip(spis, sis):
+        paths.add((spi, si))
+    return paths
+
+
+def _prefix_token(field, prefix):
+    """Return how ovs-ofctl prints the match of an IP prefix."""
+    if prefix.endswith('/32') or prefix.endswith('/128'):
+        prefix = prefix.rsplit('/', 1)[0]
+    return '%s=%s' % (field, prefix)
+
+
+def classifier_tokens(fc):
+    """Return the match tokens of a flow classifier in ovs-ofctl output."""
+    ipv6 = fc.get('ethertype') == 'IPv6'
+    tokens = []
+    if fc.get('source_ip_prefix'):
+        tokens.append(_prefix_token('ipv6_src' if ipv6 else 'nw_src',
+                                    fc['source_ip_prefix']))
+    if fc.get('destination_ip_prefix'):
+        tokens.append(_prefix_token('ipv6_dst' if ipv6 else 'nw_dst',
+                                    fc['destination_ip_prefix']))
+    if fc.get('protocol') in ('tcp', 'udp', 'icmp', 'sctp'):
+        tokens.append(fc['protocol'] + ('6' if ipv6 and fc['protocol'] != 'icmp' else ''))
+    return tokens
+
+
+def _open_dump(path):
+    if path.endswith('.gz'):
+        # gzip.open has no text mode on Python 2
+        return io.TextIOWrapper(gzip.open(path, 'rb'))
+    return open(path)
+
+
+def scan_dump(path, classifiers):
+    """Scan a flow dump in a streaming fashion.
+
+    classifiers is a list of (key, tokens, path) of the classifiers
+    expected on the node. Return the set of (path ID, service index) pairs
+    found in the dump and the set of keys of the classifiers found.
+    """
+    paths = set()
+    found = set()
+    with _open_dump(path) as f:
+        for line in f:
+            line_paths = flow_paths(line)
+            if not line_paths:
+                continue
+            paths.update(line_paths)
+            if not any(action in line for action in _ENCAP_ACTIONS):
+                continue
+            for key, tokens, path in classifiers:
+                if path in line_paths and all(token in line for token in tokens):
+                    found.add(key)
+    return paths, found
+
+
+def _port_host(topology, ref):
+    port = topology['port'].get(ref)
+    if port is None:
+        return None
+    return port.get('host')
+
+
+def verify(topology, dumps):
+    """Verify the port chains of a snapshot against the flow dumps of nodes.
+
+    topology is a snapshot loaded by snapshot_load, dumps maps the compute
+    nodes to the path of their flow dump. Return the result of the module.
+    """
+    # Expected hops and classifiers of each chain
+    hops = {}
+    classifiers = {}
+    chain_hops = {}
+    port_chains = {}
+    for pc_ref, pc in topology['port_chain'].items():
+        chain_id = pc.get('chain_id')
+        port_chains[pc_ref] = dict(chain_id=chain_id, missing_hops=[],
+                                   missing_classifiers=[])
+        if chain_id is None:
+            port_chains[pc_ref]['msg'] = 'No chain_id in the snapshot'
+            continue
+        ppg_refs = pc.get('port_pair_groups') or []
+        chain_hops[chain_id] = len(ppg_refs)
+        for index, ppg_ref in enumerate(ppg_refs):
+            si = FIRST_SERVICE_INDEX - index
+            ppg = topology['port_pair_group'].get(ppg_ref, {})
+            for pp_ref in ppg.get('port_pairs') or []:
+                pp = topology['port_pair'].get(pp_ref, {})
+                host = _port_host(topology, pp.get('ingress'))
+                if host:
+                    hops.setdefault(host, set()).add((pc_ref, index, ppg_ref,
+                                                      chain_id, si))
+        for fc_ref in pc.get('flow_classifiers') or []:
+            fc = topology['flow_classifier'].get(fc_ref, {})
+            host = _port_host(topology, fc.get('logical_source_port'))
+            if host:
+                classifiers.setdefault(host, []).append(
+                    ((pc_ref, fc_ref), classifier_tokens(fc),
+                     (chain_id, FIRST_SERVICE_INDEX)))
+
+    hosts = set(hops) | set(classifiers)
+    unverified_hosts = sorted(hosts - set(dumps))
+
+    stale = {}
+    for host, path in dumps.items():
+        try:
+            paths, found = scan_dump(path, classifiers.get(host, []))
+        except (IOError, OSError) as e:
+            raise IOError("Cannot read flow dump of %s: %s" % (host, e))
+
+        for pc_ref, index, ppg_ref, chain_id, si in sorted(hops.get(host, ())):
+            if (chain_id, si) not in paths:
+                port_chains[pc_ref]['missing_hops'].append(
+                    dict(hop=index, port_pair_group=ppg_ref, host=host,
+                         path_id=chain_id, service_index=si))
+        for (pc_ref, fc_ref), tokens, chain_path in classifiers.get(host, []):
+            if (pc_ref, fc_ref) not in found:
+                port_chains[pc_ref]['missing_classifiers'].append(
+                    dict(flow_classifier=fc_ref, host=host))
+
+        host_stale = []
+        for path_id, si in sorted(paths):
+            if path_id not in chain_hops:
+                host_stale.append([path_id, si])
+            elif si < FIRST_SERVICE_INDEX - chain_hops[path_id]:
+                host_stale.append([path_id, si])
+        if host_stale:
+            stale[host] = host_stale
+
+    return dict(
+        changed=False,
+        port_chains=port_chains,
+        missing_hops=sum(len(pc['missing_hops']) for pc in port_chains.values()),
+        missing_classifiers=sum(len(pc['missing_classifiers'])
+                                for pc in port_chains.values()),
+        stale=stale,
+        unverified_hosts=unverified_hosts)
+
+
+def main():
+    argument_spec = dict(
+        snapshot=dict(type='path', required=True),
+        dumps=dict(type='dict', required=True),
+    )
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    try:
+        topology = snapshot_load(module.params['snapshot'])
+    except (IOError, ValueError, KeyError) as e:
+        module.fail_json(msg="Cannot read snapshot: %s" % (e))
+
+    try:
+        result = verify(topology, module.params['dumps'])
+    except IOError as e:
+        module.fail_json(msg=str(e))
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
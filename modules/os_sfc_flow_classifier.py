@@ -82,6 +82,89 @@ options:
       - Dictionary of L7 parameters.
     required: true
     default: None
+  flow_classifiers:
+    description:
+      - List of flow classifiers to reconcile in one run, instead of the
+        single flow classifier given by C(name).
+      - Each item requires a C(name) and accepts C(state) and the flow
+        classifier options, which are validated and converted like the
+        options of the module. Options given to the module are the defaults
+        of the items.
+      - The logical ports and the existing flow classifiers are fetched with
+        a single listing each. New flow classifiers are created with chunked
+        bulk requests, falling back to concurrent single creates when bulk
+        requests are not supported. Updates and deletes are run
+        concurrently.
+      - The journal is not used in this mode.
+    required: false
+    default: None
+  bulk_size:
+    description:
+      - Maximum number of flow classifiers created by a bulk request.
+    required: false
+    default: 100
+  concurrency:
+    description:
+      - Maximum number of concurrent requests when bulk requests are not
+        available.
+    required: false
+    default: 10
+  journal:
+    description:
+      - Path of a local journal file. Each completed create, update, delete
+        or verification is appended to it, with a hash of the requested
+        specification.
+      - On a rerun, a flow classifier recorded in the journal with the same
+        specification and UUID is considered converged and the lookups of
+        the resources it references are skipped.
+    required: false
+    default: None
+  journal_max_age:
+    description:
+      - Age in seconds after which the journal entries are ignored, so that
+        the changes made out of band are corrected by the next runs.
+      - The expired and superseded entries are dropped from the journal
+        when a module loads it.
+    required: false
+    default: 3600
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the flow classifier is reconciled
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each reconciliation are returned in
+        C(regions).
+    required: false
+    default: None
+  return_fields:
+    description:
+      - List of the keys of the flow classifier to return, the whole flow classifier
+        is returned by default.
+    required: false
+    default: None
+  return_object:
+    description:
+      - Whether to return the flow classifier. Its UUID is always returned.
+    required: false
+    default: true
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
 '''
 
 EXAMPLES = '''
@@ -95,6 +178,25 @@ EXAMPLES = '''
     name: fc1
     source_ip_prefix: 10.20.0.0/24
     destination_ip_prefix: 10.22.2.0/24
+
+# Reconcile a list of flow classifiers with bulk requests
+- os_sfc_flow_classifier:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    logical_source_port: port1
+    protocol: tcp
+    flow_classifiers:
+    - name: fc-http
+      destination_port_range_min: 80
+      destination_port_range_max: 80
+    - name: fc-https
+      destination_port_range_min: 443
+      destination_port_range_max: 443
+    - name: fc-telnet
+      state: absent
 '''
 
 RETURN = '''
@@ -146,10 +248,16 @@ l7_parameters:
     description: Dictionary of L7 parameters.
     returned: success
     type: dict
+flow_classifiers:
+    description: Result of each item of the flow_classifiers list, with its
+                 C(name), C(action) and the flow classifier.
+    returned: when flow_classifiers is set
+    type: list
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs, openstack_cloud_from_module
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import SfcModuleExit, SfcModuleProxy, sfc_argument_spec, sfc_bulk_create_flow_classifiers, sfc_map_concurrently, sfc_result, sfc_run, journal_spec_hash, journal_is_converged, journal_record
 
 
 def _needs_update(module, fc, ports, cloud):
@@ -170,8 +278,8 @@ def _needs_update(module, fc, ports, cloud):
     compare_dict = ['l7_parameters']
 
     for key in compare_simple:
-        value = ports.get(key, fc[key])
-        if module.params[key] is not None and module.params[key] != value:
+        value = ports.get(key, module.params[key])
+        if value is not None and value != fc[key]:
             return True
     for key in compare_dict:
         if module.params[key] is not None and module.params[key] != fc[key]:
@@ -215,12 +323,22 @@ def _compose_flow_classifier_args(module, cloud, ports):
     return fc_kwargs
 
 
-def _ports_get_ids(module, cloud, fail_on_error=False):
+def _ports_get_ids(module, cloud, fail_on_error=False, ports_index=None):
+    """Resolve the logical ports of the flow classifier.
+
+    Ports are looked up in ports_index, a dictionary of the ports by name and
+    ID, when it is given.
+    """
     ports_ids = {}
 
+    def _get_port(name_or_id):
+        if ports_index is not None:
+            return ports_index.get(name_or_id)
+        return cloud.get_port(name_or_id)
+
     logical_source_port = module.params['logical_source_port']
     if logical_source_port is not None:
-        src_port = cloud.get_port(logical_source_port)
+        src_port = _get_port(logical_source_port)
         if src_port is None:
             if fail_on_error:
                 module.fail_json(
@@ -231,7 +349,7 @@ def _ports_get_ids(module, cloud, fail_on_error=False):
 
     logical_destination_port = module.params['logical_destination_port']
     if logical_destination_port is not None:
-        dst_port = cloud.get_port(logical_destination_port)
+        dst_port = _get_port(logical_destination_port)
         if dst_port is None:
             if fail_on_error:
                 module.fail_json(
@@ -243,32 +361,160 @@ def _ports_get_ids(module, cloud, fail_on_error=False):
     return ports_ids
 
 
-def main():
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=False),
-        ethertype=dict(default=None),
-        protocol=dict(default=None),
-        source_port_range_min=dict(default=None),
-        source_port_range_max=dict(default=None),
-        destination_port_range_min=dict(default=None),
-        destination_port_range_max=dict(default=None),
-        source_ip_prefix=dict(default=None),
-        destination_ip_prefix=dict(default=None),
-        logical_source_port=dict(default=None),
-        logical_destination_port=dict(default=None),
-        l7_parameters=dict(type='dict', default=None),
-        state=dict(default='present', choices=['absent', 'present']),
-    )
+# Parameters of the items of the flow_classifiers list
+_ITEM_PARAMETERS = ['name',
+                    'state',
+                    'ethertype',
+                    'protocol',
+                    'source_port_range_min',
+                    'source_port_range_max',
+                    'destination_port_range_min',
+                    'destination_port_range_max',
+                    'source_ip_prefix',
+                    'destination_ip_prefix',
+                    'logical_source_port',
+                    'logical_destination_port',
+                    'l7_parameters']
 
-    module = AnsibleModule(argument_spec,
-                           supports_check_mode=True)
 
+def _bulk_reconcile(module, shade, cloud):
+    """Reconcile the list of flow_classifiers.
+
+    The logical ports and the existing flow classifiers are fetched with one
+    listing each.
+    """
+    items = []
+    names = set()
+    for item in module.params['flow_classifiers']:
+        # Options left out of an item default to the options of the module
+        item = dict((key, value) for key, value in item.items()
+                    if value is not None)
+        if item['name'] in names:
+            module.fail_json(
+                msg="Flow classifier `%s' is listed more than once." % (item['name'])
+            )
+        names.add(item['name'])
+        items.append(SfcModuleProxy(module, **item))
+
+    # Names shared by several ports or flow classifiers can't be resolved
+    all_ports = cloud.list_ports()
+    ports_by_name = {}
+    duplicated_ports = set()
+    for port in all_ports:
+        if port['name'] in ports_by_name:
+            duplicated_ports.add(port['name'])
+        elif port['name']:
+            ports_by_name[port['name']] = port
+    ports_index = dict((port['id'], port) for port in all_ports)
+    for port_name, port in ports_by_name.items():
+        if port_name not in duplicated_ports:
+            ports_index.setdefault(port_name, port)
+
+    existing = {}
+    duplicated_fcs = set()
+    for fc in cloud.list_sfc_flow_classifiers():
+        if fc['name'] in existing:
+            duplicated_fcs.add(fc['name'])
+        elif fc['name']:
+            existing[fc['name']] = fc
+
+    creates = []
+    updates = []
+    deletes = []
+    results = {}
+    ports = {}
+    for item in items:
+        name = item.params['name']
+        if name in duplicated_fcs:
+            module.fail_json(
+                msg="Several flow classifiers are named `%s'." % (name)
+            )
+        fc = existing.get(name)
+        if item.params['state'] == 'present':
+            for key in ['logical_source_port', 'logical_destination_port']:
+                if (item.params[key] in duplicated_ports and
+                        item.params[key] not in ports_index):
+                    module.fail_json(
+                        msg="Flow classifier `%s': several ports are named `%s'." %
+                            (name, item.params[key])
+                    )
+            try:
+                ports[name] = _ports_get_ids(item, cloud, fail_on_error=True,
+                                             ports_index=ports_index)
+            except SfcModuleExit as e:
+                module.fail_json(msg="Flow classifier `%s': %s" % (name, e.result['msg']))
+            if not fc:
+                creates.append(item)
+                results[name] = dict(name=name, changed=True, action='create')
+            elif _needs_update(item, fc, ports[name], cloud):
+                updates.append((item, fc))
+                results[name] = dict(name=name, changed=True, action='update')
+            else:
+                results[name] = dict(sfc_result(item, False, 'flow_classifier', fc),
+                                     name=name, action='verify')
+        else:
+            if fc:
+                deletes.append(fc)
+                results[name] = dict(name=name, changed=True, action='delete',
+                                     id=fc['id'])
+            else:
+                results[name] = dict(name=name, changed=False, action='verify')
+
+    if not module.check_mode:
+        errors = []
+
+        fcs_kwargs = [_compose_flow_classifier_args(item, cloud, ports[item.params['name']])
+                      for item in creates]
+        created = sfc_bulk_create_flow_classifiers(shade, cloud, fcs_kwargs,
+                                                   module.params['bulk_size'],
+                                                   module.params['concurrency'])
+        for item, (fc, e) in zip(creates, created):
+            name = item.params['name']
+            if e is not None:
+                errors.append("`%s': %s" % (name, e))
+                results[name].update(changed=False, failed=True, msg=str(e))
+                continue
+            results[name].update(sfc_result(item, True, 'flow_classifier', fc))
+
+        def _update(update):
+            item, fc = update
+            fc_kwargs = _compose_flow_classifier_args(item, cloud, ports[item.params['name']])
+            return cloud.update_sfc_flow_classifier(fc['id'], **fc_kwargs)
+
+        updated = sfc_map_concurrently(_update, updates,
+                                       module.params['concurrency'])
+        for (item, old_fc), (fc, e) in zip(updates, updated):
+            name = item.params['name']
+            if e is not None:
+                errors.append("`%s': %s" % (name, e))
+                results[name].update(changed=False, failed=True, msg=str(e))
+                continue
+            results[name].update(sfc_result(item, True, 'flow_classifier', fc))
+
+        deleted = sfc_map_concurrently(
+            lambda fc: cloud.delete_sfc_flow_classifier(fc['id']),
+            deletes, module.params['concurrency'])
+        for fc, (ret, e) in zip(deletes, deleted):
+            if e is not None:
+                errors.append("`%s': %s" % (fc['name'], e))
+                results[fc['name']].update(changed=False, failed=True, msg=str(e))
+
+        if errors:
+            module.fail_json(msg='; '.join(errors),
+                             changed=any(r['changed'] for r in results.values()),
+                             flow_classifiers=list(results.values()))
+
+    module.exit_json(changed=bool(creates or updates or deletes),
+                     flow_classifiers=[results[item.params['name']] for item in items])
+
+
+def _reconcile(module, shade, cloud):
     name = module.params['name']
     state = module.params['state']
-
-    shade, cloud = openstack_cloud_from_module(module)
-    shade.simple_logging(debug=True)
     try:
+        if module.params['flow_classifiers'] is not None:
+            _bulk_reconcile(module, shade, cloud)
+
         fc = None
         if name:
             fc = cloud.get_sfc_flow_classifier(name)
@@ -277,8 +523,26 @@ def main():
             ports = _ports_get_ids(module, cloud, fail_on_error=False)
             module.exit_json(changed=_system_state_change(module, fc, ports, cloud))
 
+        journal_keys = ['name',
+                        'ethertype',
+                        'protocol',
+                        'source_port_range_min',
+                        'source_port_range_max',
+                        'destination_port_range_min',
+                        'destination_port_range_max',
+                        'source_ip_prefix',
+                        'destination_ip_prefix',
+                        'logical_source_port',
+                        'logical_destination_port',
+                        'l7_parameters']
+        spec_hash = journal_spec_hash(module, journal_keys)
+
         changed = False
         if state == 'present':
+            if journal_is_converged(module, 'flow_classifier', fc, spec_hash):
+                module.exit_json(**sfc_result(module, False, 'flow_classifier', fc))
+
+            action = 'verify'
             ports = _ports_get_ids(module, cloud)
 
             if not fc:
@@ -286,16 +550,20 @@ def main():
 
                 fc = cloud.create_sfc_flow_classifier(**fc_kwargs)
                 changed = True
+                action = 'create'
             else:
                 if _needs_update(module, fc, ports, cloud):
                     fc_kwargs = _compose_flow_classifier_args(module, cloud, ports)
                     fc = cloud.update_sfc_flow_classifier(fc['id'], **fc_kwargs)
                     changed = True
-            module.exit_json(changed=changed, id=fc['id'], flow_classifier=fc)
+                    action = 'update'
+            journal_record(module, 'flow_classifier', name, action, fc['id'], spec_hash)
+            module.exit_json(**sfc_result(module, changed, 'flow_classifier', fc))
 
         if state == 'absent':
             if fc:
                 cloud.delete_sfc_flow_classifier(fc['id'])
+                journal_record(module, 'flow_classifier', name, 'delete', fc['id'])
                 changed = True
             module.exit_json(changed=changed)
 
@@ -303,5 +571,41 @@ def main():
         module.fail_json(msg=str(e))
 
 
+def main():
+    argument_spec = openstack_full_argument_spec(
+        name=dict(required=False),
+        ethertype=dict(default=None),
+        protocol=dict(default=None),
+        source_port_range_min=dict(type='int', default=None),
+        source_port_range_max=dict(type='int', default=None),
+        destination_port_range_min=dict(type='int', default=None),
+        destination_port_range_max=dict(type='int', default=None),
+        source_ip_prefix=dict(default=None),
+        destination_ip_prefix=dict(default=None),
+        logical_source_port=dict(default=None),
+        logical_destination_port=dict(default=None),
+        l7_parameters=dict(type='dict', default=None),
+        flow_classifiers=dict(type='list', default=None),
+        bulk_size=dict(type='int', default=100),
+        concurrency=dict(type='int', default=10),
+        state=dict(default='present', choices=['absent', 'present']),
+    )
+    item_options = dict((key, dict(argument_spec[key], default=None))
+                        for key in _ITEM_PARAMETERS)
+    item_options['name'] = dict(required=True)
+    argument_spec['flow_classifiers'].update(elements='dict', options=item_options)
+    argument_spec.update(sfc_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           mutually_exclusive=[['name', 'flow_classifiers']],
+                           supports_check_mode=True)
+
+    for key in ['bulk_size', 'concurrency']:
+        if module.params[key] < 1:
+            module.fail_json(msg="`%s' must be at least 1." % (key))
+
+    sfc_run(module, _reconcile)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: os_sfc_flow_estimate
+short_description: Estimate the OVS flows of a networking-sfc topology per compute node.
+author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+version_added: "2.5"
+description:
+  - Estimate the number of OVS flow entries that the networking-sfc OVS
+    agent programs on each compute node for each port chain, from the
+    classifier count, the size of the port pair groups and the correlation
+    of the chains and port pairs.
+  - Runs offline, from a snapshot written by os_sfc_snapshot_export and/or a
+    topology given with the options of the SFC modules, without connecting
+    to the cloud.
+  - The model is an estimate, per hop and per host it counts the delivery
+    flows of each port pair, the egress flows of each port pair (one per
+    classifier when the service function is not aware of the chain
+    correlation and the flows are proxied), a group with one bucket per
+    port pair of the next hop, and the classification flows of the
+    classifiers on the hosts of their logical source ports. Symmetric
+    chains count twice.
+options:
+  snapshot:
+    description:
+      - Path of a snapshot written by os_sfc_snapshot_export.
+    required: false
+    default: None
+  topology:
+    description:
+      - Dictionary with C(port_pairs), C(port_pair_groups),
+        C(flow_classifiers) and C(port_chains) lists, whose items take the
+        options of the os_sfc_port_pair, os_sfc_port_pair_group,
+        os_sfc_flow_classifier and os_sfc_port_chain modules.
+      - Items override the snapshot resources with the same name.
+    required: false
+    default: None
+  port_bindings:
+    description:
+      - Dictionary mapping the names or IDs of the ports to the compute node
+        they are bound to. Overrides the bindings of the snapshot.
+    required: false
+    default: None
+  flow_budget:
+    description:
+      - Maximum number of flow entries of a compute node. The module fails
+        when the estimate of a compute node exceeds it.
+    required: false
+    default: None
+'''
+
+EXAMPLES = '''
+# Check that adding a classifier to pc1 keeps the hosts under 5000 flows
+- os_sfc_flow_estimate:
+    snapshot: /var/backups/sfc.jsonl
+    topology:
+      flow_classifiers:
+      - name: fc3
+        logical_source_port: port7
+        destination_ip_prefix: 10.22.3.0/24
+      port_chains:
+      - name: pc1
+        port_pair_groups:
+        - ppg1
+        flow_classifiers:
+        - fc1
+        - fc3
+    port_bindings:
+      port7: compute-3
+    flow_budget: 5000
+'''
+
+RETURN = '''
+hosts:
+    description: Estimated flow entries of each compute node, with their
+                 C(total) and the flows of each port chain in C(port_chains).
+                 Unbound ports are counted on the C(unbound) host.
+    returned: success
+    type: dict
+port_chains:
+    description: Estimated flow entries of each port chain, on all hosts.
+    returned: success
+    type: dict
+over_budget:
+    description: List of the compute nodes exceeding flow_budget.
+    returned: when flow_budget is set
+    type: list
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.os_sfc import snapshot_load
+
+
+UNBOUND_HOST = 'unbound'
+
+# Flow entries programmed per port pair for the delivery to its ingress
+# port, and the additional entry that strips the encapsulation when the
+# service function is not aware of the chain correlation.
+DELIVERY_FLOWS = 1
+PROXY_DELIVERY_FLOWS = 1
+# Flow entries matching the traffic leaving the egress port of a port pair
+# that is aware of the chain correlation, the other ones need one entry per
+# flow classifier to reclassify the traffic.
+AWARE_EGRESS_FLOWS = 1
+# Flow entries forwarding the traffic of a hop to the next one: a group,
+# plus one bucket per port pair of the next hop. The last hop uses a single
+# entry to return the traffic to the normal pipeline.
+GROUP_FLOWS = 1
+LAST_HOP_FLOWS = 1
+
+
+def _load_topology(module):
+    topology = dict(port={}, port_pair={}, port_pair_group={},
+                    flow_classifier={}, port_chain={})
+    if module.params['snapshot']:
+        try:
+            topology = snapshot_load(module.params['snapshot'])
+        except (IOError, ValueError, KeyError) as e:
+            module.fail_json(msg="Cannot read snapshot: %s" % (e))
+
+    for key, kind in [('port_pairs', 'port_pair'),
+                      ('port_pair_groups', 'port_pair_group'),
+                      ('flow_classifiers', 'flow_classifier'),
+                      ('port_chains', 'port_chain')]:
+        for item in (module.params['topology'] or {}).get(key, []):
+            if not item.get('name'):
+                module.fail_json(
+                    msg="Items of topology %s require a name." % (key)
+                )
+            topology[kind][item['name']] = item
+
+    return topology
+
+
+def _port_hosts(module, topology):
+    hosts = {}
+    for ref, port in topology['port'].items():
+        hosts[ref] = port.get('host') or UNBOUND_HOST
+        hosts[port['id']] = hosts[ref]
+    hosts.update(module.params['port_bindings'] or {})
+    return hosts
+
+
+def _get(module, topology, kind, ref):
+    if ref not in topology[kind]:
+        module.fail_json(
+            msg="Specified %s `%s' was not found." % (kind.replace('_', ' '), ref)
+        )
+    return topology[kind][ref]
+
+
+def _estimate_port_chain(module, topology, port_hosts, pc):
+    """Return the estimated flow entries of a port chain on each host."""
+    flows = {}
+
+    def _add(host, count):
+        flows[host] = flows.get(host, 0) + count
+
+    correlation = (pc.get('chain_parameters') or {}).get('correlation', 'mpls')
+    fcs = [_get(module, topology, 'flow_classifier', ref)
+           for ref in pc.get('flow_classifiers') or []]
+    groups = []
+    for ppg_ref in pc.get('port_pair_groups') or []:
+        ppg = _get(module, topology, 'port_pair_group', ppg_ref)
+        groups.append([_get(module, topology, 'port_pair', ref)
+                       for ref in ppg.get('port_pairs') or []])
+
+    # Classification, and forwarding to the first hop
+    fc_hosts = set()
+    for fc in fcs:
+        host = port_hosts.get(fc.get('logical_source_port'), UNBOUND_HOST)
+        _add(host, 1)
+        fc_hosts.add(host)
+    if groups:
+        for host in fc_hosts:
+            _add(host, GROUP_FLOWS + len(groups[0]))
+
+    for index, pps in enumerate(groups):
+        pp_hosts = set()
+        for pp in pps:
+            host = port_hosts.get(pp.get('ingress'), UNBOUND_HOST)
+            pp_hosts.add(host)
+            sf_correlation = (pp.get('service_function_parameters') or {}).get('correlation')
+            _add(host, DELIVERY_FLOWS)
+            if sf_correlation == correlation:
+                _add(host, AWARE_EGRESS_FLOWS)
+            else:
+                _add(host, PROXY_DELIVERY_FLOWS + max(len(fcs), 1))
+
+        for host in pp_hosts:
+            if index + 1 < len(groups):
+                _add(host, GROUP_FLOWS + len(groups[index + 1]))
+            else:
+                _add(host, LAST_HOP_FLOWS)
+
+    if (pc.get('chain_parameters') or {}).get('symmetric'):
+        flows = dict((host, count * 2) for host, count in flows.items())
+
+    return flows
+
+
+def main():
+    argument_spec = dict(
+        snapshot=dict(type='path', default=None),
+        topology=dict(type='dict', default=None),
+        port_bindings=dict(type='dict', default=None),
+        flow_budget=dict(type='int', default=None),
+    )
+
+    module = AnsibleModule(argument_spec,
+                           required_one_of=[['snapshot', 'topology']],
+                           supports_check_mode=True)
+
+    topology = _load_topology(module)
+    port_hosts = _port_hosts(module, topology)
+
+    hosts = {}
+    port_chains = {}
+    for pc_ref, pc in sorted(topology['port_chain'].items()):
+        flows = _estimate_port_chain(module, topology, port_hosts, pc)
+        port_chains[pc_ref] = sum(flows.values())
+        for host, count in flows.items():
+            host_flows = hosts.setdefault(host, dict(total=0, port_chains={}))
+            host_flows['total'] += count
+            host_flows['port_chains'][pc_ref] = count
+
+    result = dict(changed=False, hosts=hosts, port_chains=port_chains)
+
+    flow_budget = module.params['flow_budget']
+    if flow_budget is not None:
+        result['over_budget'] = sorted(host for host, host_flows in hosts.items()
+                                       if host_flows['total'] > flow_budget)
+        if result['over_budget']:
+            module.fail_json(
+                msg="Compute nodes %s exceed the flow budget of %d entries." %
+                    (', '.join(result['over_budget']), flow_budget),
+                **result)
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -46,6 +46,81 @@ options:
       - Data-plane chain path ID.
     required: false
     default: None
+  update_strategy:
+    description:
+      - How a change of the port pair groups of an existing chain is applied.
+      - With C(inplace), the chain is updated directly, traffic is interrupted
+        while the flows are removed and reinstalled.
+      - With C(cutover), a shadow chain is built with the new port pair groups
+        and, once it is active, the flow classifiers are moved from the old
+        chain to the shadow chain, the old chain is deleted and the shadow
+        chain is renamed. The chain gets a new UUID and a new chain_id, so
+        C(chain_id) cannot be used with this strategy.
+      - The shadow chain C(<name>-cutover) is marked with a description, and
+        gets the description of the old chain when it is renamed.
+      - A cutover interrupted by a failure is resumed by the next run: the
+        shadow chain C(<name>-cutover) is deleted when the flow classifiers
+        were not moved yet, otherwise the old chain is deleted and the
+        shadow chain is renamed.
+    required: false
+    default: inplace
+    choices: ['inplace', 'cutover']
+  journal:
+    description:
+      - Path of a local journal file. Each completed create, update, delete
+        or verification is appended to it, with a hash of the requested
+        specification.
+      - On a rerun, a port chain recorded in the journal with the same
+        specification and UUID is considered converged and the lookups of
+        the resources it references are skipped.
+    required: false
+    default: None
+  journal_max_age:
+    description:
+      - Age in seconds after which the journal entries are ignored, so that
+        the changes made out of band are corrected by the next runs.
+      - The expired and superseded entries are dropped from the journal
+        when a module loads it.
+    required: false
+    default: 3600
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the port chain is reconciled
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each reconciliation are returned in
+        C(regions).
+    required: false
+    default: None
+  return_fields:
+    description:
+      - List of the keys of the port chain to return, the whole port chain
+        is returned by default.
+    required: false
+    default: None
+  return_object:
+    description:
+      - Whether to return the port chain. Its UUID is always returned.
+    required: false
+    default: true
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
 '''
 
 EXAMPLES = '''
@@ -64,6 +139,36 @@ EXAMPLES = '''
     chain_id: 1
     chain_parameters:
         correlation: nsh
+
+# Replace the port pair groups of a live chain through a shadow chain
+- os_sfc_port_chain:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    name: pc1
+    update_strategy: cutover
+    port_pair_groups:
+    - ppg1
+    - ppg3
+    flow_classifiers:
+    - fc1
+
+# Create the same port chain in several regions concurrently
+- os_sfc_port_chain:
+    state: present
+    cloud: mycloud
+    clouds:
+    - region_name: RegionOne
+    - region_name: RegionTwo
+    - cloud: othercloud
+      region_name: RegionOne
+    name: pc2
+    port_pair_groups:
+    - ppg1
+    flow_classifiers:
+    - fc2
 '''
 
 RETURN = '''
@@ -91,10 +196,23 @@ chain_id:
     description: Data-plane chain path ID.
     returned: success
     type: integer
+cutover_window:
+    description: Time in seconds during which the flow classifiers were
+                 detached from both chains.
+    returned: when a cutover was performed
+    type: float
+regions:
+    description: Result of each cloud, with its C(cloud), C(region_name) and
+                 the C(elapsed) time of its reconciliation in seconds.
+    returned: when clouds is set
+    type: list
 '''
 
+import time
+
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs, openstack_cloud_from_module
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import sfc_argument_spec, sfc_count_retry, sfc_result, sfc_run, journal_spec_hash, journal_is_converged, journal_record
 
 
 def _needs_update(module, pc, pc_ids, cloud):
@@ -107,17 +225,22 @@ def _needs_update(module, pc, pc_ids, cloud):
                     'flow_classifiers']
     compare_dict = ['chain_parameters']
 
+    pc_ids = pc_ids or {}
+
     for key in compare_simple:
-        value = pc_ids.get(key, pc[key])
-        if module.params[key] is not None and module.params[key] != value:
+        if module.params[key] is not None and module.params[key] != pc[key]:
             return True
     for key in compare_list:
-        value = pc_ids.get(key, pc[key])
-        if module.params[key] is not None and (set(module.param[key]) !=
-                                               set(value)):
+        value = pc_ids.get(key, module.params[key])
+        if value is None:
+            continue
+        # The order of the port pair groups defines the chain
+        if key == 'port_pair_groups' and list(value) != list(pc[key]):
+            return True
+        if set(value) != set(pc[key]):
             return True
     for key in compare_dict:
-        if module.params[key] is not None and module.params[key] != value:
+        if module.params[key] is not None and module.params[key] != pc[key]:
             return True
 
     return False
@@ -150,6 +273,107 @@ def _compose_port_chain_args(module, pc_ids, cloud):
     return pc_kwargs
 
 
+def _wait_for_port_chain(module, cloud, pc):
+    """Wait for a port chain to become active.
+
+    Port chains that don't report a status are considered active.
+    """
+    timeout = module.params['timeout']
+    deadline = time.time() + timeout
+    while pc.get('status', 'ACTIVE') != 'ACTIVE':
+        if pc['status'] == 'ERROR':
+            module.fail_json(
+                msg="Port chain `%s' went to ERROR state." % (pc['name'])
+            )
+        if time.time() > deadline:
+            module.fail_json(
+                msg="Timeout waiting for port chain `%s' to become active." % (pc['name'])
+            )
+        time.sleep(1)
+        sfc_count_retry(cloud, 'get_sfc_port_chain')
+        pc = cloud.get_sfc_port_chain(pc['id'])
+
+    return pc
+
+
+# Description of the shadow chains, with the name of the chain
+_CUTOVER_DESCRIPTION = 'Shadow chain of a cutover of %s by os_sfc_port_chain'
+
+
+def _port_chain_cutover(module, cloud, pc, pc_ids):
+    """Replace a port chain by a shadow chain built with the new groups.
+
+    The flow classifiers are the only part of the chain that is shared by
+    the two chains, the time they spend detached is the traffic gap of the
+    cutover and is returned with the new chain.
+    """
+    if module.params['chain_id'] is not None:
+        module.fail_json(
+            msg="Parameter 'chain_id' cannot be kept across a port chain cutover"
+        )
+
+    pc_kwargs = _compose_port_chain_args(module, pc_ids, cloud)
+    flow_classifiers = pc_kwargs.pop('flow_classifiers', pc['flow_classifiers'])
+    pc_kwargs['name'] = '%s-cutover' % (pc['name'])
+    pc_kwargs['description'] = _CUTOVER_DESCRIPTION % (pc['name'])
+    pc_kwargs.setdefault('chain_parameters', pc['chain_parameters'])
+
+    shadow = cloud.create_sfc_port_chain(**pc_kwargs)
+    moved = False
+    try:
+        if module.params['wait']:
+            shadow = _wait_for_port_chain(module, cloud, shadow)
+
+        start = time.time()
+        cloud.update_sfc_port_chain(pc['id'], flow_classifiers=[])
+        try:
+            shadow = cloud.update_sfc_port_chain(
+                shadow['id'], flow_classifiers=flow_classifiers)
+        except Exception:
+            cloud.update_sfc_port_chain(
+                pc['id'], flow_classifiers=pc['flow_classifiers'])
+            raise
+        window = time.time() - start
+        moved = True
+    finally:
+        if not moved:
+            cloud.delete_sfc_port_chain(shadow['id'])
+
+    cloud.delete_sfc_port_chain(pc['id'])
+    shadow = cloud.update_sfc_port_chain(shadow['id'], name=pc['name'],
+                                         description=pc.get('description') or '')
+
+    return shadow, window
+
+
+def _port_chain_resume_cutover(module, cloud, pc):
+    """Finish or roll back the cutover of a previous run.
+
+    Only the chains created by a cutover, with their description, are shadow
+    chains. Return the port chain and whether a leftover shadow chain was
+    found.
+    """
+    name = module.params['name']
+    shadow = cloud.get_sfc_port_chain('%s-cutover' % (name))
+    if not shadow or shadow.get('description') != _CUTOVER_DESCRIPTION % (name):
+        return pc, False
+    if module.check_mode:
+        return pc, True
+
+    if pc and (pc['flow_classifiers'] or not shadow['flow_classifiers']):
+        # The flow classifiers were not moved, the cutover is started over
+        cloud.delete_sfc_port_chain(shadow['id'])
+        return pc, True
+
+    description = ''
+    if pc:
+        description = pc.get('description') or ''
+        cloud.delete_sfc_port_chain(pc['id'])
+    shadow = cloud.update_sfc_port_chain(shadow['id'], name=name,
+                                         description=description)
+    return shadow, True
+
+
 def _port_chains_get_ids(module, cloud, fail_on_error=True):
     pc_ids = {
         'port_pair_groups': [],
@@ -195,35 +419,36 @@ def _port_chains_get_ids(module, cloud, fail_on_error=True):
     return pc_ids
 
 
-def main():
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=False),
-        port_pair_groups=dict(type='list', default=None),
-        flow_classifiers=dict(type='list', default=None),
-        chain_parameters=dict(type='dict', default=None),
-        chain_id=dict(default=None),
-        state=dict(default='present', choices=['absent', 'present']),
-    )
-
-    module = AnsibleModule(argument_spec,
-                           supports_check_mode=True)
-
+def _reconcile(module, shade, cloud):
     name = module.params['name']
     state = module.params['state']
-
-    shade, cloud = openstack_cloud_from_module(module)
-    shade.simple_logging(debug=True)
     try:
         pc = None
         if name:
             pc = cloud.get_sfc_port_chain(name)
 
+        resumed = False
+        if name and module.params['update_strategy'] == 'cutover':
+            pc, resumed = _port_chain_resume_cutover(module, cloud, pc)
+
         if module.check_mode:
             pc_ids = _port_chains_get_ids(module, cloud, fail_on_error=False)
-            module.exit_json(changed=_system_state_change(module, pc, pc_ids, cloud))
+            module.exit_json(changed=resumed or
+                             _system_state_change(module, pc, pc_ids, cloud))
+
+        journal_keys = ['name',
+                        'port_pair_groups',
+                        'flow_classifiers',
+                        'chain_parameters',
+                        'chain_id']
+        spec_hash = journal_spec_hash(module, journal_keys)
 
-        changed = False
+        changed = resumed
         if state == 'present':
+            if journal_is_converged(module, 'port_chain', pc, spec_hash):
+                module.exit_json(**sfc_result(module, changed, 'port_chain', pc))
+
+            action = 'update' if resumed else 'verify'
             pc_ids = _port_chains_get_ids(module, cloud)
 
             if not pc:
@@ -231,16 +456,26 @@ def main():
 
                 pc = cloud.create_sfc_port_chain(**pc_kwargs)
                 changed = True
+                action = 'create'
             else:
                 if _needs_update(module, pc, pc_ids, cloud):
+                    if (module.params['update_strategy'] == 'cutover' and
+                            pc_ids['port_pair_groups'] != pc['port_pair_groups']):
+                        pc, window = _port_chain_cutover(module, cloud, pc, pc_ids)
+                        journal_record(module, 'port_chain', name, 'update', pc['id'], spec_hash)
+                        module.exit_json(**sfc_result(module, True, 'port_chain', pc,
+                                                      cutover_window=window))
                     pc_kwargs = _compose_port_chain_args(module, pc_ids, cloud)
                     pc = cloud.update_sfc_port_chain(pc['id'], **pc_kwargs)
                     changed = True
-            module.exit_json(changed=changed, id=pc['id'], port_chain=pc)
+                    action = 'update'
+            journal_record(module, 'port_chain', name, action, pc['id'], spec_hash)
+            module.exit_json(**sfc_result(module, changed, 'port_chain', pc))
 
         if state == 'absent':
             if pc:
                 cloud.delete_sfc_port_chain(pc['id'])
+                journal_record(module, 'port_chain', name, 'delete', pc['id'])
                 changed = True
             module.exit_json(changed=changed)
 
@@ -248,5 +483,23 @@ def main():
         module.fail_json(msg=str(e))
 
 
+def main():
+    argument_spec = openstack_full_argument_spec(
+        name=dict(required=False),
+        port_pair_groups=dict(type='list', default=None),
+        flow_classifiers=dict(type='list', default=None),
+        chain_parameters=dict(type='dict', default=None),
+        chain_id=dict(type='int', default=None),
+        update_strategy=dict(default='inplace', choices=['inplace', 'cutover']),
+        state=dict(default='present', choices=['absent', 'present']),
+    )
+    argument_spec.update(sfc_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    sfc_run(module, _reconcile)
+
+
 if __name__ == '__main__':
     main()
@@ -41,6 +41,70 @@ options:
       - Parameters of the port pair with dictionary structure.
     required: false
     default: None
+  wait_for_ports:
+    description:
+      - Wait for the ingress and egress ports to be ACTIVE and bound to a host
+        before creating or updating the port pair.
+      - The ports are polled together with a single port listing per poll,
+        with an exponential backoff, for up to C(timeout) seconds.
+    required: false
+    default: false
+  journal:
+    description:
+      - Path of a local journal file. Each completed create, update, delete
+        or verification is appended to it, with a hash of the requested
+        specification.
+      - On a rerun, a port pair recorded in the journal with the same
+        specification and UUID is considered converged and the lookups of
+        the resources it references are skipped.
+    required: false
+    default: None
+  journal_max_age:
+    description:
+      - Age in seconds after which the journal entries are ignored, so that
+        the changes made out of band are corrected by the next runs.
+      - The expired and superseded entries are dropped from the journal
+        when a module loads it.
+    required: false
+    default: 3600
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the port pair is reconciled
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each reconciliation are returned in
+        C(regions).
+    required: false
+    default: None
+  return_fields:
+    description:
+      - List of the keys of the port pair to return, the whole port pair
+        is returned by default.
+    required: false
+    default: None
+  return_object:
+    description:
+      - Whether to return the port pair. Its UUID is always returned.
+    required: false
+    default: true
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
 '''
 
 EXAMPLES = '''
@@ -67,6 +131,19 @@ EXAMPLES = '''
     egress: 837ef6d9-5582-4f51-a2fc-a561bcaf30c7
     service_function_parameters:
         correlation: nsh
+
+# Create a port pair once the ports of a freshly booted VNF are bound
+- os_sfc_port_pair:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    name: pp2
+    ingress: port3
+    egress: port4
+    wait_for_ports: true
+    timeout: 300
 '''
 
 RETURN = '''
@@ -92,8 +169,11 @@ service_function_parameters:
     type: dict
 '''
 
+import time
+
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs, openstack_cloud_from_module
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import sfc_argument_spec, sfc_count_retry, sfc_result, sfc_run, journal_spec_hash, journal_is_converged, journal_record
 
 
 def _needs_update(module, pp, ports, cloud):
@@ -149,7 +229,7 @@ def _ports_get_ids(module, cloud, fail_on_error=True):
             module.fail_json(
                 msg="Parameter 'ingress' is required in Sfc Port Pair Create"
             )
-        return port_ids
+        return ports_ids
 
     egress = module.params['egress']
     if not egress:
@@ -157,7 +237,7 @@ def _ports_get_ids(module, cloud, fail_on_error=True):
             module.fail_json(
                 msg="Parameter 'egress' is required in Sfc Port Pair Create"
             )
-        return port_ids
+        return ports_ids
 
     ingress_port = cloud.get_port(ingress)
     if ingress_port is None:
@@ -180,23 +260,42 @@ def _ports_get_ids(module, cloud, fail_on_error=True):
     return ports_ids
 
 
-def main():
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=False),
-        ingress=dict(default=None),
-        egress=dict(default=None),
-        service_function_parameters=dict(type='dict', default=None),
-        state=dict(default='present', choices=['absent', 'present']),
-    )
+def _port_is_ready(port):
+    if port['status'] != 'ACTIVE':
+        return False
+    if not port.get('binding:host_id'):
+        return False
+    return port.get('binding:vif_type') not in ('unbound', 'binding_failed')
 
-    module = AnsibleModule(argument_spec,
-                           supports_check_mode=True)
 
+def _wait_for_ports(module, cloud, ports):
+    """Wait for the ports to be ACTIVE and bound.
+
+    All the ports are fetched with one listing per poll, the delay between
+    two polls doubles up to 10 seconds.
+    """
+    port_ids = sorted(set(ports.values()))
+    deadline = time.time() + module.params['timeout']
+    delay = 1
+    while True:
+        ready = set(port['id']
+                    for port in cloud.list_ports(filters={'id': port_ids})
+                    if _port_is_ready(port))
+        pending = [port_id for port_id in port_ids if port_id not in ready]
+        if not pending:
+            return
+        if time.time() + delay > deadline:
+            module.fail_json(
+                msg="Timeout waiting for ports %s to become active." % (', '.join(pending))
+            )
+        time.sleep(delay)
+        delay = min(delay * 2, 10)
+        sfc_count_retry(cloud, 'list_ports')
+
+
+def _reconcile(module, shade, cloud):
     name = module.params['name']
     state = module.params['state']
-
-    shade, cloud = openstack_cloud_from_module(module)
-    shade.simple_logging(debug=True)
     try:
         pp = None
         if name:
@@ -206,9 +305,22 @@ def main():
             ports = _ports_get_ids(module, cloud, fail_on_error=False)
             module.exit_json(changed=_system_state_change(module, pp, ports, cloud))
 
+        journal_keys = ['name',
+                        'ingress',
+                        'egress',
+                        'service_function_parameters']
+        spec_hash = journal_spec_hash(module, journal_keys)
+
         changed = False
         if state == 'present':
+            if journal_is_converged(module, 'port_pair', pp, spec_hash):
+                module.exit_json(**sfc_result(module, False, 'port_pair', pp))
+
+            action = 'verify'
             ports = _ports_get_ids(module, cloud)
+            if module.params['wait_for_ports']:
+                _wait_for_ports(module, cloud, ports)
+
             if not pp:
 
                 pp_kwargs = _compose_port_pair_args(module, cloud)
@@ -217,16 +329,20 @@ def main():
 
                 pp = cloud.create_sfc_port_pair(**pp_kwargs)
                 changed = True
+                action = 'create'
             else:
                 if _needs_update(module, pp, ports, cloud):
                     pp_kwargs = _compose_port_pair_args(module, cloud)
                     pp = cloud.update_sfc_port_pair(pp['id'], **pp_kwargs)
                     changed = True
-            module.exit_json(changed=changed, id=pp['id'], port_pair=pp)
+                    action = 'update'
+            journal_record(module, 'port_pair', name, action, pp['id'], spec_hash)
+            module.exit_json(**sfc_result(module, changed, 'port_pair', pp))
 
         if state == 'absent':
             if pp:
                 cloud.delete_sfc_port_pair(pp['id'])
+                journal_record(module, 'port_pair', name, 'delete', pp['id'])
                 changed = True
             module.exit_json(changed=changed)
 
@@ -234,5 +350,22 @@ def main():
         module.fail_json(msg=str(e))
 
 
+def main():
+    argument_spec = openstack_full_argument_spec(
+        name=dict(required=False),
+        ingress=dict(default=None),
+        egress=dict(default=None),
+        service_function_parameters=dict(type='dict', default=None),
+        wait_for_ports=dict(type='bool', default=False),
+        state=dict(default='present', choices=['absent', 'present']),
+    )
+    argument_spec.update(sfc_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    sfc_run(module, _reconcile)
+
+
 if __name__ == '__main__':
     main()
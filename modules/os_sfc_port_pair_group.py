@@ -36,6 +36,116 @@ options:
       - Dictionary of port pair group parameters.
     required: false
     default: None
+  host_locality:
+    description:
+      - networking-sfc balances the traffic of a group over all its port
+        pairs wherever they are bound, the order of the port pairs doesn't
+        keep the traffic on a compute node.
+      - When enabled, the port pairs are partitioned by the compute node
+        their ingress port is bound to, into one port pair group per host
+        named C(<name>-<host>) with the same C(port_pair_group_parameters),
+        instead of a single group C(name). Port chains referencing the group
+        of a host keep the traffic of the hop on that host.
+      - networking-sfc allows a port pair in a single group, the port pairs
+        moving to another group are removed from their group first, and
+        from the group C(name) when it exists.
+      - The bindings of all the ports are fetched with a single port listing,
+        the module fails when a port pair has unbound ports.
+      - The groups of the hosts that no longer host a port pair are left
+        empty, as port chains may still reference them. With C(state=absent),
+        all the groups of the hosts are deleted.
+      - Only applied with the C(replace) mode of C(port_pairs_mode). The
+        journal is not used with this option.
+    required: false
+    default: false
+  port_pairs_mode:
+    description:
+      - With C(replace), C(port_pairs) is the whole list of port pairs of the
+        group.
+      - With C(add) or C(remove), the port pairs of C(port_pairs) are added
+        to or removed from the group, keeping the other ones, so that many
+        tasks can share a group. The group is created when it is missing.
+      - Concurrent C(add) and C(remove) tasks of a group are serialized
+        with a lock in C(coordination_dir), and the changes queued during
+        C(coalesce_window) are merged into a single update of the group.
+      - C(host_locality) is not applied with C(add) and C(remove), which
+        require a C(name). Removing a port pair that doesn't exist is a
+        no-op.
+      - C(port_pair_group_parameters) is applied along with the merged
+        update by the task holding the lock, the tasks sharing a group
+        should set the same parameters.
+    required: false
+    default: replace
+    choices: ['replace', 'add', 'remove']
+  coalesce_window:
+    description:
+      - Time in seconds during which the C(add) and C(remove) changes of
+        concurrent tasks are collected before updating the group.
+    required: false
+    default: 0
+  coordination_dir:
+    description:
+      - Directory of the queues and locks of the C(add) and C(remove) modes,
+        it must be shared by the concurrent tasks, typically by delegating
+        them to the controller.
+    required: false
+    default: the system temporary directory
+  journal:
+    description:
+      - Path of a local journal file. Each completed create, update, delete
+        or verification is appended to it, with a hash of the requested
+        specification.
+      - On a rerun, a port pair group recorded in the journal with the same
+        specification and UUID is considered converged and the lookups of
+        the resources it references are skipped.
+    required: false
+    default: None
+  journal_max_age:
+    description:
+      - Age in seconds after which the journal entries are ignored, so that
+        the changes made out of band are corrected by the next runs.
+      - The expired and superseded entries are dropped from the journal
+        when a module loads it.
+    required: false
+    default: 3600
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the port pair group is reconciled
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each reconciliation are returned in
+        C(regions).
+    required: false
+    default: None
+  return_fields:
+    description:
+      - List of the keys of the port pair group to return, the whole port pair group
+        is returned by default.
+    required: false
+    default: None
+  return_object:
+    description:
+      - Whether to return the port pair group. Its UUID is always returned.
+    required: false
+    default: true
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
 '''
 
 EXAMPLES = '''
@@ -62,12 +172,40 @@ EXAMPLES = '''
     port_pairs:
     - ff4983af-fd05-4057-b93d-00fb6e295e81
     - a4dd748a-832c-487f-839e-314f8e950872
+
+# Create a port pair group, and one group per compute node of its port pairs
+- os_sfc_port_pair_group:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    name: ppg3
+    host_locality: true
+    port_pairs:
+    - pp1
+    - pp2
+    - pp3
+
+# Add the port pair of each VNF host to a shared group, with one update
+- os_sfc_port_pair_group:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    name: ppg-shared
+    port_pairs_mode: add
+    coalesce_window: 2
+    port_pairs:
+    - "pp-{{ inventory_hostname }}"
+  delegate_to: localhost
 '''
 
 RETURN = '''
 id:
     description: Unique UUID.
-    returned: success
+    returned: when host_locality is disabled
     type: string
 name:
     description: Name given to the port pair group.
@@ -81,10 +219,32 @@ port_pair_group_parameters:
     description: Dictionary of port pair group parameters.
     returned: success
     type: dict
+host_groups:
+    description: Dictionary mapping the compute nodes to the UUID of their
+                 port pair group.
+    returned: when host_locality is enabled
+    type: dict
+coalesced:
+    description: Number of membership changes merged in the update made by
+                 this task, 0 when a concurrent task made the update.
+    returned: when port_pairs_mode is add or remove
+    type: int
 '''
 
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs, openstack_cloud_from_module
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import sfc_argument_spec, sfc_result, sfc_run, journal_spec_hash, journal_is_converged, journal_record
+
+
+# Description of the port pair groups of the hosts, with the name of the group
+_HOST_GROUP_DESCRIPTION = 'Port pairs of a host, partitioned from %s by os_sfc_port_pair_group'
 
 
 def _needs_update(module, ppg, port_pairs, cloud):
@@ -94,7 +254,14 @@ def _needs_update(module, ppg, port_pairs, cloud):
     """
     compare_dict = ['port_pair_group_parameters']
 
-    if set(port_pairs) != set(ppg['port_pairs']):
+    mode = module.params['port_pairs_mode']
+    if mode == 'add':
+        if not set(port_pairs) <= set(ppg['port_pairs']):
+            return True
+    elif mode == 'remove':
+        if set(port_pairs) & set(ppg['port_pairs']):
+            return True
+    elif set(port_pairs) != set(ppg['port_pairs']):
         return True
     for key in compare_dict:
         if module.params[key] is not None and module.params[key] != ppg[key]:
@@ -126,7 +293,203 @@ def _compose_port_pair_group_args(module, cloud, port_pairs):
     return ppg_kwargs
 
 
-def _port_pairs_get_ids(module, cloud, fail_on_error=True):
+def _coordination_paths(module):
+    """Return the paths of the intent queue and of the lock of the group."""
+    key = json.dumps([module.params['name'], module.params.get('cloud'),
+                      module.params.get('region_name')], sort_keys=True)
+    prefix = os.path.join(module.params['coordination_dir'],
+                          'os_sfc_ppg_%s' % (hashlib.sha1(key.encode('utf-8')).hexdigest()))
+    return prefix + '.queue', prefix + '.lock'
+
+
+def _merge_membership(port_pairs, intents):
+    port_pairs = list(port_pairs)
+    for intent in intents:
+        for pp_id in intent['port_pairs']:
+            if intent['mode'] == 'add' and pp_id not in port_pairs:
+                port_pairs.append(pp_id)
+            elif intent['mode'] == 'remove' and pp_id in port_pairs:
+                port_pairs.remove(pp_id)
+    return port_pairs
+
+
+def _intent_applied(ppg, intent):
+    members = set(ppg['port_pairs']) if ppg else set()
+    if intent['mode'] == 'add':
+        return bool(ppg) and set(intent['port_pairs']) <= members
+    return not set(intent['port_pairs']) & members
+
+
+def _coalesced_membership_update(module, cloud, port_pairs):
+    """Add or remove port pairs of a group shared by concurrent tasks.
+
+    The change is queued as an intent in a controller-local file. After
+    coalesce_window seconds, the first task that gets the lock of the group
+    merges all the queued intents into a single update of a freshly read
+    group, with the port_pair_group_parameters of this task. The other tasks
+    find an empty queue. They check that the group has their change and
+    their parameters, and apply them when the update of the other task
+    failed.
+    Return the group, None when it doesn't exist, and the number of intents
+    applied by this task.
+    """
+    queue_path, lock_path = _coordination_paths(module)
+    intent = dict(mode=module.params['port_pairs_mode'], port_pairs=port_pairs)
+    with open(queue_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(intent) + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+    time.sleep(module.params['coalesce_window'])
+
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(queue_path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            intents = [json.loads(line) for line in f if line.strip()]
+            f.seek(0)
+            f.truncate()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+        ppg = cloud.get_sfc_port_pair_group(module.params['name'])
+        parameters = module.params['port_pair_group_parameters']
+        if not intents:
+            if (_intent_applied(ppg, intent) and
+                    (parameters is None or parameters == ppg['port_pair_group_parameters'])):
+                # A concurrent task applied our intent
+                return ppg, 0
+            intents = [intent]
+
+        if not ppg:
+            merged = _merge_membership([], intents)
+            if not merged:
+                return None, len(intents)
+            ppg_kwargs = _compose_port_pair_group_args(module, cloud, merged)
+            return cloud.create_sfc_port_pair_group(**ppg_kwargs), len(intents)
+
+        ppg_kwargs = {}
+        merged = _merge_membership(ppg['port_pairs'], intents)
+        if merged != ppg['port_pairs']:
+            ppg_kwargs['port_pairs'] = merged
+        if parameters is not None and parameters != ppg['port_pair_group_parameters']:
+            ppg_kwargs['port_pair_group_parameters'] = parameters
+        if ppg_kwargs:
+            ppg = cloud.update_sfc_port_pair_group(ppg['id'], **ppg_kwargs)
+        return ppg, len(intents)
+
+
+def _port_pairs_partition_by_host(module, cloud, port_pairs):
+    """Partition port pairs by the compute node of their ingress port.
+
+    Return a dictionary mapping the hosts to the IDs of their port pairs.
+    """
+    port_ids = set()
+    for pp in port_pairs:
+        port_ids.add(pp['ingress'])
+        port_ids.add(pp['egress'])
+    if not port_ids:
+        return {}
+
+    hosts = {}
+    for port in cloud.list_ports(filters={'id': sorted(port_ids)}):
+        hosts[port['id']] = port.get('binding:host_id') or None
+
+    partition = {}
+    unbound = []
+    for pp in port_pairs:
+        host = hosts.get(pp['ingress']) or hosts.get(pp['egress'])
+        if host:
+            partition.setdefault(host, []).append(pp['id'])
+        else:
+            unbound.append(pp['name'] or pp['id'])
+    if unbound:
+        module.fail_json(
+            msg="Port pairs `%s' have unbound ports, they can't be partitioned by host." %
+                ("', `".join(unbound))
+        )
+    return partition
+
+
+def _host_groups_get(module, cloud):
+    """Return the port pair groups of the hosts, by host.
+
+    They are recognized by their name and their description, so that
+    unrelated groups whose name starts with the name of the group are left
+    untouched.
+    """
+    prefix = '%s-' % (module.params['name'])
+    description = _HOST_GROUP_DESCRIPTION % (module.params['name'])
+    host_groups = {}
+    for ppg in cloud.list_sfc_port_pair_groups():
+        if (ppg['name'] and ppg['name'].startswith(prefix) and
+                ppg.get('description') == description):
+            host_groups[ppg['name'][len(prefix):]] = ppg
+    return host_groups
+
+
+def _host_locality_reconcile(module, cloud, ppg):
+    """Reconcile the port pair groups of the hosts, and exit.
+
+    The groups losing port pairs are updated before the groups gaining
+    them, as a port pair can't be in two groups at once.
+    """
+    name = module.params['name']
+    host_groups = _host_groups_get(module, cloud)
+
+    if module.params['state'] == 'absent':
+        deletes = list(host_groups.values())
+        if ppg:
+            deletes.append(ppg)
+        if not module.check_mode:
+            for group in deletes:
+                cloud.delete_sfc_port_pair_group(group['id'])
+        module.exit_json(changed=bool(deletes))
+
+    partition = _port_pairs_partition_by_host(module, cloud,
+                                              _port_pairs_get(module, cloud))
+    moved = set(pp_id for pp_ids in partition.values() for pp_id in pp_ids)
+
+    shrinks = []
+    if ppg:
+        shrinks.append((ppg, [pp_id for pp_id in ppg['port_pairs'] if pp_id not in moved]))
+    for host, group in sorted(host_groups.items()):
+        shrinks.append((group, [pp_id for pp_id in group['port_pairs']
+                                if pp_id in partition.get(host, [])]))
+
+    changed = False
+    for group, port_pairs in shrinks:
+        if port_pairs != group['port_pairs']:
+            changed = True
+            if not module.check_mode:
+                group.update(cloud.update_sfc_port_pair_group(group['id'], port_pairs=port_pairs))
+
+    result = {}
+    for host, pp_ids in sorted(partition.items()):
+        group = host_groups.get(host)
+        if group and not _needs_update(module, group, pp_ids, cloud):
+            result[host] = group['id']
+            continue
+
+        changed = True
+        if module.check_mode:
+            continue
+        ppg_kwargs = _compose_port_pair_group_args(module, cloud, pp_ids)
+        if group:
+            del ppg_kwargs['name']
+            group = cloud.update_sfc_port_pair_group(group['id'], **ppg_kwargs)
+        else:
+            ppg_kwargs.update(name='%s-%s' % (name, host),
+                              description=_HOST_GROUP_DESCRIPTION % (name))
+            group = cloud.create_sfc_port_pair_group(**ppg_kwargs)
+        result[host] = group['id']
+
+    for host, group in host_groups.items():
+        result.setdefault(host, group['id'])
+    module.exit_json(changed=changed, host_groups=result)
+
+
+def _port_pairs_get(module, cloud, fail_on_error=True):
     port_pair_ids = module.params['port_pairs']
     if not port_pair_ids:
         if fail_on_error:
@@ -143,55 +506,90 @@ def _port_pairs_get_ids(module, cloud, fail_on_error=True):
                 module.fail_json(
                     msg="Specified port pair `%s' was not found." % (pp_name)
                 )
-        port_pairs.append(pp['id'])
+            continue
+        port_pairs.append(pp)
 
     return port_pairs
 
 
-def main():
-    argument_spec = openstack_full_argument_spec(
-        name=dict(required=False),
-        port_pairs=dict(type='list', default=None),
-        port_pair_group_parameters=dict(type='dict', default=None),
-        state=dict(default='present', choices=['absent', 'present']),
-    )
+def _port_pairs_get_ids(module, cloud, fail_on_error=True):
+    port_pairs = _port_pairs_get(module, cloud, fail_on_error=fail_on_error)
+    if port_pairs is None:
+        return None
+    return [pp['id'] for pp in port_pairs]
 
-    module = AnsibleModule(argument_spec,
-                           supports_check_mode=True)
 
+def _reconcile(module, shade, cloud):
     name = module.params['name']
     state = module.params['state']
-
-    shade, cloud = openstack_cloud_from_module(module)
-    shade.simple_logging(debug=True)
     try:
         ppg = None
         if name:
             ppg = cloud.get_sfc_port_pair_group(name)
 
+        if module.params['host_locality'] and module.params['port_pairs_mode'] == 'replace':
+            _host_locality_reconcile(module, cloud, ppg)
+
         if module.check_mode:
-            port_pairs_ids = _port_pairs_get_ids(module, cloud, fail_on_error=False)
+            port_pairs = _port_pairs_get(module, cloud, fail_on_error=False)
+            port_pairs_ids = None
+            if port_pairs is not None:
+                port_pairs_ids = [pp['id'] for pp in port_pairs]
             module.exit_json(changed=_system_state_change(module, ppg, port_pairs_ids, cloud))
 
+        journal_keys = ['name',
+                        'port_pairs',
+                        'port_pair_group_parameters',
+                        'port_pairs_mode',
+                        'host_locality']
+        spec_hash = journal_spec_hash(module, journal_keys)
+
         changed = False
         if state == 'present':
-            port_pairs_ids = _port_pairs_get_ids(module, cloud)
+            if journal_is_converged(module, 'port_pair_group', ppg, spec_hash):
+                module.exit_json(**sfc_result(module, False, 'port_pair_group', ppg))
+
+            action = 'verify'
+            # Removing a port pair that no longer exists is a no-op
+            port_pairs = _port_pairs_get(
+                module, cloud, fail_on_error=module.params['port_pairs_mode'] != 'remove')
+            port_pairs_ids = [pp['id'] for pp in port_pairs or []]
+
+            if module.params['port_pairs_mode'] != 'replace':
+                coalesced = 0
+                if _system_state_change(module, ppg, port_pairs_ids, cloud):
+                    if not ppg and module.params['port_pairs_mode'] == 'remove':
+                        module.exit_json(changed=False)
+                    ppg, coalesced = _coalesced_membership_update(module, cloud,
+                                                                  port_pairs_ids)
+                    changed = True
+                    action = 'update'
+                    if not ppg:
+                        # The group was deleted by a concurrent task
+                        module.exit_json(changed=changed, coalesced=coalesced)
+                journal_record(module, 'port_pair_group', name, action, ppg['id'], spec_hash)
+                module.exit_json(**sfc_result(module, changed, 'port_pair_group', ppg,
+                                              coalesced=coalesced))
 
             if not ppg:
                 ppg_kwargs = _compose_port_pair_group_args(module, cloud, port_pairs_ids)
 
                 ppg = cloud.create_sfc_port_pair_group(**ppg_kwargs)
                 changed = True
+                action = 'create'
             else:
                 if _needs_update(module, ppg, port_pairs_ids, cloud):
-                    ppg_kwargs = _compose_port_pair_groups_args(module, cloud, port_pairs_ids)
-                    ppg = cloud.update_sfc_port_pair(ppg['id'], **ppg_kwargs)
+                    ppg_kwargs = _compose_port_pair_group_args(module, cloud, port_pairs_ids)
+                    ppg = cloud.update_sfc_port_pair_group(ppg['id'], **ppg_kwargs)
                     changed = True
-            module.exit_json(changed=changed, id=ppg['id'], port_pair_group=ppg)
+                    action = 'update'
+            journal_record(module, 'port_pair_group', name, action, ppg['id'], spec_hash)
+            module.exit_json(**sfc_result(module, changed, 'port_pair_group', ppg))
 
         if state == 'absent':
             if ppg:
                 cloud.delete_sfc_port_pair_group(ppg['id'])
+                journal_record(module, 'port_pair_group', name, 'delete', ppg['id'])
                 changed = True
             module.exit_json(changed=changed)
 
@@ -199,5 +597,27 @@ def main():
         module.fail_json(msg=str(e))
 
 
+def main():
+    argument_spec = openstack_full_argument_spec(
+        name=dict(required=False),
+        port_pairs=dict(type='list', default=None),
+        port_pair_group_parameters=dict(type='dict', default=None),
+        host_locality=dict(type='bool', default=False),
+        port_pairs_mode=dict(default='replace', choices=['replace', 'add', 'remove']),
+        coalesce_window=dict(type='float', default=0),
+        coordination_dir=dict(type='path', default=tempfile.gettempdir()),
+        state=dict(default='present', choices=['absent', 'present']),
+    )
+    argument_spec.update(sfc_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           required_if=[('host_locality', True, ['name']),
+                                        ('port_pairs_mode', 'add', ['name', 'port_pairs']),
+                                        ('port_pairs_mode', 'remove', ['name', 'port_pairs'])],
+                           supports_check_mode=True)
+
+    sfc_run(module, _reconcile)
+
+
 if __name__ == '__main__':
     main()
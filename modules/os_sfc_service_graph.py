@@ -0,0 +1,339 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: os_sfc_service_graph
+short_description: Add/Update/Delete service graphs from OpenStack networking-sfc.
+extends_documentation_fragment: openstack
+author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+version_added: "2.5"
+description:
+  - Add, Update or Remove service graphs from OpenStack networking-sfc.
+  - A service graph links existing port chains, so that branching
+    topologies share chain segments instead of duplicating whole chains
+    and their flow classifiers.
+  - The port chains are resolved with a single listing.
+  - networking-sfc does not allow to update the port chains of a service
+    graph, the graph is replaced when its edges change.
+options:
+  name:
+    description:
+      - Name that has to be given to the service graph.
+    required: true
+  description:
+    description:
+      - Description of the service graph.
+    required: false
+    default: None
+  port_chains:
+    description:
+      - Dictionary of the edges of the graph, mapping the name or ID of a
+        port chain to the list of the names or IDs of the port chains that
+        follow it.
+    required: true
+  journal:
+    description:
+      - Path of a local journal file. Each completed create, update, delete
+        or verification is appended to it, with a hash of the requested
+        specification.
+      - On a rerun, a service graph recorded in the journal with the same
+        specification and UUID is considered converged and the lookups of
+        the port chains it references are skipped.
+    required: false
+    default: None
+  journal_max_age:
+    description:
+      - Age in seconds after which the journal entries are ignored, so that
+        the changes made out of band are corrected by the next runs.
+      - The expired and superseded entries are dropped from the journal
+        when a module loads it.
+    required: false
+    default: 3600
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the service graph is reconciled
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each reconciliation are returned in
+        C(regions).
+    required: false
+    default: None
+  return_fields:
+    description:
+      - List of the keys of the service graph to return, the whole service
+        graph is returned by default.
+    required: false
+    default: None
+  return_object:
+    description:
+      - Whether to return the service graph. Its UUID is always returned.
+    required: false
+    default: true
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
+'''
+
+EXAMPLES = '''
+# Create a service graph branching from pc1 to pc2 and pc3
+- os_sfc_service_graph:
+    state: present
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    name: sg1
+    port_chains:
+      pc1:
+      - pc2
+      - pc3
+'''
+
+RETURN = '''
+id:
+    description: Unique UUID.
+    returned: success
+    type: string
+service_graph:
+    description: The service graph, with its C(port_chains) edges by UUID.
+    returned: success
+    type: dict
+added_edges:
+    description: List of the [source, destination] port chain UUIDs that
+                 were added to the graph.
+    returned: success
+    type: list
+removed_edges:
+    description: List of the [source, destination] port chain UUIDs that
+                 were removed from the graph.
+    returned: success
+    type: list
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import sfc_argument_spec, sfc_network_call, sfc_result, sfc_run, journal_spec_hash, journal_is_converged, journal_record
+
+
+def _get_service_graph(module, cloud, name):
+    data = sfc_network_call(
+        cloud, 'search_sfc_service_graphs', 'get',
+        '/sfc/service_graphs.json', params={'name': name},
+        error_message="Error fetching service graph %s" % (name))
+    service_graphs = data['service_graphs']
+    if len(service_graphs) > 1:
+        module.fail_json(
+            msg="Multiple service graphs named `%s' were found." % (name)
+        )
+    return service_graphs[0] if service_graphs else None
+
+
+def _create_service_graph(cloud, **kwargs):
+    data = sfc_network_call(
+        cloud, 'create_sfc_service_graph', 'post',
+        '/sfc/service_graphs.json', json={'service_graph': kwargs},
+        error_message="Error creating service graph %s" % (kwargs['name']))
+    return data['service_graph']
+
+
+def _update_service_graph(cloud, sg_id, **kwargs):
+    data = sfc_network_call(
+        cloud, 'update_sfc_service_graph', 'put',
+        '/sfc/service_graphs/%s.json' % (sg_id), json={'service_graph': kwargs},
+        error_message="Error updating service graph %s" % (sg_id))
+    return data['service_graph']
+
+
+def _delete_service_graph(cloud, sg_id):
+    sfc_network_call(
+        cloud, 'delete_sfc_service_graph', 'delete',
+        '/sfc/service_graphs/%s.json' % (sg_id),
+        error_message="Error deleting service graph %s" % (sg_id))
+
+
+def _edges(port_chains):
+    return set((src, dst) for src, dsts in port_chains.items() for dst in dsts)
+
+
+def _edges_diff(sg, edges):
+    """Return the added and removed edges, as sorted lists."""
+    current = _edges(sg['port_chains']) if sg else set()
+    return (sorted(list(edge) for edge in edges - current),
+            sorted(list(edge) for edge in current - edges))
+
+
+def _needs_update(module, sg, edges, cloud):
+    """Check for differences in the updatable values.
+
+    NOTE: We don't currently allow name updates.
+    """
+    if edges is not None and _edges(sg['port_chains']) != edges:
+        return True
+    if (module.params['description'] is not None and
+            module.params['description'] != sg['description']):
+        return True
+
+    return False
+
+
+def _system_state_change(module, sg, edges, cloud):
+    state = module.params['state']
+    if state == 'present':
+        if not sg:
+            return True
+        return _needs_update(module, sg, edges, cloud)
+    if state == 'absent' and sg:
+        return True
+    return False
+
+
+def _compose_service_graph_args(module, edges):
+    sg_kwargs = {}
+    optional_parameters = ['name',
+                           'description']
+    for optional_param in optional_parameters:
+        if module.params[optional_param] is not None:
+            sg_kwargs[optional_param] = module.params[optional_param]
+
+    port_chains = {}
+    for src, dst in sorted(edges):
+        port_chains.setdefault(src, []).append(dst)
+    sg_kwargs['port_chains'] = port_chains
+
+    return sg_kwargs
+
+
+def _port_chains_get_edges(module, cloud, fail_on_error=True):
+    port_chains = module.params['port_chains']
+    if not port_chains:
+        if fail_on_error:
+            module.fail_json(
+                msg="Parameter 'port_chains' is required in Sfc Service Graph Create"
+            )
+        return None
+
+    pc_ids = {}
+    for pc in cloud.list_sfc_port_chains():
+        pc_ids[pc['id']] = pc['id']
+        if pc['name']:
+            pc_ids[pc['name']] = pc['id']
+
+    edges = set()
+    for src, dsts in port_chains.items():
+        if not isinstance(dsts, list):
+            dsts = [dsts]
+        for pc_name in [src] + list(dsts):
+            if pc_name not in pc_ids:
+                if fail_on_error:
+                    module.fail_json(
+                        msg="Specified port chain `%s' was not found." % (pc_name)
+                    )
+                return None
+        for dst in dsts:
+            edges.add((pc_ids[src], pc_ids[dst]))
+
+    return edges
+
+
+def _reconcile(module, shade, cloud):
+    name = module.params['name']
+    state = module.params['state']
+    try:
+        sg = _get_service_graph(module, cloud, name)
+
+        if module.check_mode:
+            edges = _port_chains_get_edges(module, cloud, fail_on_error=False)
+            module.exit_json(changed=_system_state_change(module, sg, edges, cloud))
+
+        journal_keys = ['name',
+                        'description',
+                        'port_chains']
+        spec_hash = journal_spec_hash(module, journal_keys)
+
+        changed = False
+        if state == 'present':
+            if journal_is_converged(module, 'service_graph', sg, spec_hash):
+                module.exit_json(**sfc_result(module, False, 'service_graph', sg,
+                                              added_edges=[], removed_edges=[]))
+
+            action = 'verify'
+            edges = _port_chains_get_edges(module, cloud)
+            added_edges, removed_edges = _edges_diff(sg, edges)
+
+            if not sg:
+                sg_kwargs = _compose_service_graph_args(module, edges)
+                sg = _create_service_graph(cloud, **sg_kwargs)
+                changed = True
+                action = 'create'
+            elif added_edges or removed_edges:
+                # The port chains of a service graph can't be updated
+                sg_kwargs = _compose_service_graph_args(module, edges)
+                _delete_service_graph(cloud, sg['id'])
+                sg = _create_service_graph(cloud, **sg_kwargs)
+                changed = True
+                action = 'update'
+            elif _needs_update(module, sg, edges, cloud):
+                sg = _update_service_graph(cloud, sg['id'],
+                                           description=module.params['description'])
+                changed = True
+                action = 'update'
+            journal_record(module, 'service_graph', name, action, sg['id'], spec_hash)
+            module.exit_json(**sfc_result(module, changed, 'service_graph', sg,
+                                          added_edges=added_edges,
+                                          removed_edges=removed_edges))
+
+        if state == 'absent':
+            if sg:
+                _delete_service_graph(cloud, sg['id'])
+                journal_record(module, 'service_graph', name, 'delete', sg['id'])
+                changed = True
+            module.exit_json(changed=changed)
+
+    except shade.OpenStackCloudException as e:
+        module.fail_json(msg=str(e))
+
+
+def main():
+    argument_spec = openstack_full_argument_spec(
+        name=dict(required=True),
+        description=dict(default=None),
+        port_chains=dict(type='dict', default=None),
+        state=dict(default='present', choices=['absent', 'present']),
+    )
+    argument_spec.update(sfc_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    sfc_run(module, _reconcile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: os_sfc_snapshot_export
+short_description: Export the OpenStack networking-sfc topology to a snapshot file.
+extends_documentation_fragment: openstack
+author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+version_added: "2.5"
+description:
+  - Export all the port pairs, port pair groups, flow classifiers and port
+    chains of a project into a versioned JSON-lines snapshot file, that can
+    be restored with os_sfc_snapshot_restore.
+  - Each resource type is fetched with a single listing. Resources reference
+    each other and their Neutron ports by name, or by UUID when the name is
+    empty or not unique.
+  - The ports referenced by the topology are exported with the host they
+    are bound to.
+options:
+  path:
+    description:
+      - Path of the snapshot file.
+    required: true
+  api_stats:
+    description:
+      - Return the latency of each API call in C(sfc_api_stats), for the
+        C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
+'''
+
+EXAMPLES = '''
+# Export the SFC topology of a project
+- os_sfc_snapshot_export:
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    path: /var/backups/sfc.jsonl
+'''
+
+RETURN = '''
+path:
+    description: Path of the snapshot file.
+    returned: success
+    type: string
+counts:
+    description: Number of exported resources of each kind.
+    returned: success
+    type: dict
+'''
+
+import os
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import SNAPSHOT_KINDS, sfc_run, snapshot_dumps, snapshot_header, snapshot_refs
+
+
+def _export(f, cloud):
+    counts = dict.fromkeys(SNAPSHOT_KINDS, 0)
+
+    pps = cloud.list_sfc_port_pairs()
+    ppgs = cloud.list_sfc_port_pair_groups()
+    fcs = cloud.list_sfc_flow_classifiers()
+    pcs = cloud.list_sfc_port_chains()
+
+    port_ids = set()
+    for pp in pps:
+        port_ids.add(pp['ingress'])
+        port_ids.add(pp['egress'])
+    for fc in fcs:
+        port_ids.add(fc['logical_source_port'])
+        port_ids.add(fc['logical_destination_port'])
+    port_ids.discard(None)
+
+    ports = [port for port in cloud.list_ports() if port['id'] in port_ids]
+    port_refs = snapshot_refs(ports)
+    for port in ports:
+        f.write(snapshot_dumps(dict(kind='port',
+                                    name=port['name'],
+                                    id=port['id'],
+                                    host=port.get('binding:host_id'))))
+        counts['port'] += 1
+
+    pp_refs = snapshot_refs(pps)
+    for pp in pps:
+        f.write(snapshot_dumps(dict(
+            kind='port_pair',
+            name=pp['name'],
+            id=pp['id'],
+            description=pp.get('description'),
+            ingress=port_refs.get(pp['ingress'], pp['ingress']),
+            egress=port_refs.get(pp['egress'], pp['egress']),
+            service_function_parameters=pp.get('service_function_parameters'))))
+        counts['port_pair'] += 1
+
+    fc_refs = snapshot_refs(fcs)
+    for fc in fcs:
+        record = dict(kind='flow_classifier',
+                      name=fc['name'],
+                      id=fc['id'],
+                      description=fc.get('description'),
+                      l7_parameters=fc.get('l7_parameters') or None)
+        for key in ['ethertype',
+                    'protocol',
+                    'source_port_range_min',
+                    'source_port_range_max',
+                    'destination_port_range_min',
+                    'destination_port_range_max',
+                    'source_ip_prefix',
+                    'destination_ip_prefix']:
+            record[key] = fc.get(key)
+        for key in ['logical_source_port',
+                    'logical_destination_port']:
+            record[key] = port_refs.get(fc[key], fc[key])
+        f.write(snapshot_dumps(record))
+        counts['flow_classifier'] += 1
+
+    ppg_refs = snapshot_refs(ppgs)
+    for ppg in ppgs:
+        f.write(snapshot_dumps(dict(
+            kind='port_pair_group',
+            name=ppg['name'],
+            id=ppg['id'],
+            description=ppg.get('description'),
+            port_pairs=[pp_refs.get(pp_id, pp_id) for pp_id in ppg['port_pairs']],
+            port_pair_group_parameters=ppg.get('port_pair_group_parameters'))))
+        counts['port_pair_group'] += 1
+
+    for pc in pcs:
+        f.write(snapshot_dumps(dict(
+            kind='port_chain',
+            name=pc['name'],
+            id=pc['id'],
+            description=pc.get('description'),
+            port_pair_groups=[ppg_refs.get(ppg_id, ppg_id)
+                              for ppg_id in pc['port_pair_groups']],
+            flow_classifiers=[fc_refs.get(fc_id, fc_id)
+                              for fc_id in pc['flow_classifiers']],
+            chain_parameters=pc.get('chain_parameters'),
+            chain_id=pc.get('chain_id'))))
+        counts['port_chain'] += 1
+
+    return counts
+
+
+def _reconcile(module, shade, cloud):
+    path = module.params['path']
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(snapshot_header())
+                counts = _export(f, cloud)
+
+            changed = (not os.path.exists(path) or
+                       module.module.sha1(path) != module.module.sha1(tmp_path))
+            if changed and not module.check_mode:
+                module.module.atomic_move(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        module.exit_json(changed=changed, path=path, counts=counts)
+
+    except shade.OpenStackCloudException as e:
+        module.fail_json(msg=str(e))
+
+
+def main():
+    argument_spec = openstack_full_argument_spec(
+        path=dict(type='path', required=True),
+        api_stats=dict(type='bool', default=False),
+        sfc_profile=dict(type='path', default=None),
+    )
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    sfc_run(module, _reconcile)
+
+
+if __name__ == '__main__':
+    main()
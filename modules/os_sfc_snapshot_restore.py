@@ -0,0 +1,303 @@
+#!/usr/bin/python
+
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: os_sfc_snapshot_restore
+short_description: Restore the OpenStack networking-sfc topology from a snapshot file.
+extends_documentation_fragment: openstack
+author: "Gregory Thiemonge <gregory.thiemonge@enea.com>"
+version_added: "2.5"
+description:
+  - Create the port pairs, port pair groups, flow classifiers and port
+    chains of a snapshot written by os_sfc_snapshot_export.
+  - The Neutron ports and the existing SFC resources are fetched with a
+    single listing per resource type. Resources that already exist are left
+    untouched, they are matched on their name when it is unique, otherwise
+    on their name and their ports, port pairs, port pair groups or flow
+    classifiers, so that the restore can be run again.
+  - Resources are created in dependency order, the resources of a same level
+    are created concurrently, and the flow classifiers with bulk requests.
+  - The Neutron ports referenced by the snapshot must exist.
+options:
+  path:
+    description:
+      - Path of the snapshot file.
+    required: true
+  concurrency:
+    description:
+      - Maximum number of concurrent create requests.
+    required: false
+    default: 10
+  bulk_size:
+    description:
+      - Maximum number of flow classifiers created by a bulk request, 1
+        disables the bulk requests.
+    required: false
+    default: 100
+  api_stats:
+    description:
+      - Return the latency of each API call and the number of retried calls
+        in C(sfc_api_stats), for the C(os_sfc_api_stats) callback plugin.
+    required: false
+    default: false
+  clouds:
+    description:
+      - List of clouds or regions in which the snapshot is restored
+        concurrently, each with its own connection.
+      - Items are cloud names or dictionaries with C(cloud) and
+        C(region_name) keys, missing keys default to the C(cloud) and
+        C(region_name) options.
+      - The result and the duration of each restore are returned in
+        C(regions).
+    required: false
+    default: None
+  sfc_profile:
+    description:
+      - Directory in which the run of the module is profiled with cProfile
+        and tracemalloc, also enabled by the C(OS_SFC_PROFILE_DIR)
+        environment variable.
+      - A .prof file with the cProfile stats and a .json summary with the
+        time spent in imports, API calls and diffing and the top allocations
+        are written, their path prefix is returned in C(sfc_profile).
+    required: false
+    default: None
+'''
+
+EXAMPLES = '''
+# Restore the SFC topology of a project
+- os_sfc_snapshot_restore:
+    auth_url: https://identity.example.com
+    username: admin
+    password: admin
+    project_name: admin
+    path: /var/backups/sfc.jsonl
+    concurrency: 20
+'''
+
+RETURN = '''
+created:
+    description: Number of created resources of each kind.
+    returned: success
+    type: dict
+existing:
+    description: Number of resources of each kind that already existed.
+    returned: success
+    type: dict
+'''
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.openstack import openstack_full_argument_spec, openstack_module_kwargs
+from ansible.module_utils.os_sfc import SNAPSHOT_KINDS, sfc_bulk_create_flow_classifiers, sfc_map_concurrently, sfc_run, sfc_run_argument_spec, snapshot_read, snapshot_refs
+
+
+# Resources of a level only reference resources of the previous levels
+_LEVELS = [['port_pair', 'flow_classifier'],
+           ['port_pair_group'],
+           ['port_chain']]
+
+# Fields matching the resources whose name is empty or not unique
+_MATCH_FIELDS = {
+    'port_pair': ['ingress', 'egress'],
+    'flow_classifier': ['ethertype',
+                        'protocol',
+                        'source_port_range_min',
+                        'source_port_range_max',
+                        'destination_port_range_min',
+                        'destination_port_range_max',
+                        'source_ip_prefix',
+                        'destination_ip_prefix',
+                        'logical_source_port',
+                        'logical_destination_port'],
+    'port_pair_group': ['port_pairs'],
+    'port_chain': ['port_pair_groups', 'flow_classifiers'],
+}
+
+# List fields whose order doesn't matter
+_UNORDERED_FIELDS = ['port_pairs', 'flow_classifiers']
+
+
+def _resolve(module, refs, kind, ref):
+    if ref is None:
+        return None
+    if ref not in refs[kind]:
+        module.fail_json(
+            msg="Snapshot references an unknown %s `%s'." % (kind.replace('_', ' '), ref)
+        )
+    if refs[kind][ref] is None:
+        module.fail_json(
+            msg="Snapshot references the %s `%s', which is ambiguous in the cloud." %
+                (kind.replace('_', ' '), ref)
+        )
+    return refs[kind][ref]
+
+
+def _compose_args(module, refs, record):
+    kwargs = dict((key, value) for key, value in record.items()
+                  if key not in ('kind', 'id'))
+    kind = record['kind']
+    if kind == 'port_pair':
+        for key in ['ingress', 'egress']:
+            kwargs[key] = _resolve(module, refs, 'port', record.get(key))
+    elif kind == 'flow_classifier':
+        for key in ['logical_source_port', 'logical_destination_port']:
+            if key in record:
+                kwargs[key] = _resolve(module, refs, 'port', record[key])
+    elif kind == 'port_pair_group':
+        kwargs['port_pairs'] = [_resolve(module, refs, 'port_pair', ref)
+                                for ref in record.get('port_pairs', [])]
+    elif kind == 'port_chain':
+        kwargs['port_pair_groups'] = [_resolve(module, refs, 'port_pair_group', ref)
+                                      for ref in record.get('port_pair_groups', [])]
+        kwargs['flow_classifiers'] = [_resolve(module, refs, 'flow_classifier', ref)
+                                      for ref in record.get('flow_classifiers', [])]
+    return kwargs
+
+
+def _match_key(kind, resource):
+    key = [resource.get('name') or '']
+    for field in _MATCH_FIELDS[kind]:
+        value = resource.get(field)
+        if field in _UNORDERED_FIELDS:
+            value = sorted(value or [])
+        key.append(value)
+    return json.dumps(key, sort_keys=True)
+
+
+def _reconcile(module, shade, cloud):
+    try:
+        records = dict((kind, []) for kind in SNAPSHOT_KINDS)
+        try:
+            for record in snapshot_read(module.params['path']):
+                records[record['kind']].append(record)
+        except (IOError, ValueError, KeyError) as e:
+            module.fail_json(msg="Cannot read snapshot: %s" % (e))
+
+        # Snapshot references of the ports are resolved against the existing
+        # ports, the other ones against the restored resources.
+        # Names of several ports are ambiguous and mapped to None.
+        refs = dict((kind, {}) for kind in SNAPSHOT_KINDS)
+        port_names = {}
+        for port in cloud.list_ports():
+            refs['port'][port['id']] = port['id']
+            if port['name']:
+                port_names.setdefault(port['name'], []).append(port['id'])
+        for port_name, port_ids in port_names.items():
+            if len(port_ids) > 1:
+                refs['port'].setdefault(port_name, None)
+            else:
+                refs['port'].setdefault(port_name, port_ids[0])
+
+        resources = {
+            'port_pair': cloud.list_sfc_port_pairs(),
+            'flow_classifier': cloud.list_sfc_flow_classifiers(),
+            'port_pair_group': cloud.list_sfc_port_pair_groups(),
+            'port_chain': cloud.list_sfc_port_chains(),
+        }
+        existing_names = {}
+        existing_keys = {}
+        for kind, kind_resources in resources.items():
+            names = {}
+            for resource in kind_resources:
+                if resource['name']:
+                    names.setdefault(resource['name'], []).append(resource['id'])
+            existing_names[kind] = names
+            existing_keys[kind] = {}
+            for resource in kind_resources:
+                existing_keys[kind].setdefault(_match_key(kind, resource), []).append(resource['id'])
+
+        created = dict.fromkeys(SNAPSHOT_KINDS[1:], 0)
+        existing = dict.fromkeys(SNAPSHOT_KINDS[1:], 0)
+        for level in _LEVELS:
+            missing = []
+            for kind in level:
+                record_refs = snapshot_refs(records[kind])
+                for record in records[kind]:
+                    ref = record_refs[record['id']]
+                    if ref == record.get('name') and len(existing_names[kind].get(ref, [])) == 1:
+                        refs[kind][ref] = existing_names[kind][ref][0]
+                        existing[kind] += 1
+                        continue
+                    # Each existing resource matches a single record
+                    key = _match_key(kind, _compose_args(module, refs, record))
+                    matches = existing_keys[kind].get(key)
+                    if matches:
+                        refs[kind][ref] = matches.pop(0)
+                        existing[kind] += 1
+                    else:
+                        missing.append((ref, record))
+
+            if module.check_mode:
+                # Resources of the next levels may reference them
+                for ref, record in missing:
+                    refs[record['kind']][ref] = ref
+                    created[record['kind']] += 1
+                continue
+
+            def _create(item):
+                ref, record = item
+                kwargs = _compose_args(module, refs, record)
+                create = getattr(cloud, 'create_sfc_%s' % (record['kind']))
+                return create(**kwargs)
+
+            # Flow classifiers are created with bulk requests
+            missing.sort(key=lambda item: item[1]['kind'] == 'flow_classifier')
+            fcs_kwargs = [_compose_args(module, refs, record) for ref, record in missing
+                          if record['kind'] == 'flow_classifier']
+            results = sfc_map_concurrently(_create, missing[:len(missing) - len(fcs_kwargs)],
+                                           module.params['concurrency'])
+            results.extend(sfc_bulk_create_flow_classifiers(
+                shade, cloud, fcs_kwargs, module.params['bulk_size'],
+                module.params['concurrency']))
+            errors = []
+            for (ref, record), (resource, e) in zip(missing, results):
+                if e is not None:
+                    errors.append("%s `%s': %s" % (record['kind'], ref, e))
+                    continue
+                refs[record['kind']][ref] = resource['id']
+                created[record['kind']] += 1
+            if errors:
+                module.fail_json(msg='; '.join(errors),
+                                 changed=any(created.values()),
+                                 created=created, existing=existing)
+
+        module.exit_json(changed=any(created.values()),
+                         created=created, existing=existing)
+
+    except shade.OpenStackCloudException as e:
+        module.fail_json(msg=str(e))
+
+
+def main():
+    argument_spec = openstack_full_argument_spec(
+        path=dict(type='path', required=True),
+        concurrency=dict(type='int', default=10),
+        bulk_size=dict(type='int', default=100),
+    )
+    argument_spec.update(sfc_run_argument_spec())
+
+    module = AnsibleModule(argument_spec,
+                           supports_check_mode=True)
+
+    for key in ['bulk_size', 'concurrency']:
+        if module.params[key] < 1:
+            module.fail_json(msg="`%s' must be at least 1." % (key))
+
+    sfc_run(module, _reconcile)
+
+
+if __name__ == '__main__':
+    main()
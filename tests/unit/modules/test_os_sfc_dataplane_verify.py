@@ -0,0 +1,102 @@
+# Copyright (c) 2018 Enea
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import gzip
+import os
+import shutil
+import sys
+
+import pytest
+
+pytest.importorskip('ansible.module_utils.openstack')
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir)
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'os_sfc_dataplane_verify')
+
+
+def _load_source(name, path):
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        # Python 2
+        import imp
+        return imp.load_source(name, path)
+    module = module_from_spec(spec_from_file_location(name, path))
+    sys.modules[name] = module
+    module.__spec__.loader.exec_module(module)
+    return module
+
+
+# The module utils of the repository are imported as Ansible module utils
+if 'ansible.module_utils.os_sfc' not in sys.modules:
+    _load_source('ansible.module_utils.os_sfc', os.path.join(ROOT, 'module_utils', 'os_sfc.py'))
+from ansible.module_utils.os_sfc import snapshot_load
+
+verify = _load_source('os_sfc_dataplane_verify',
+                      os.path.join(ROOT, 'modules', 'os_sfc_dataplane_verify.py'))
+
+
+def _fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+def _dumps(mpls_dump=None):
+    return {'compute-1': mpls_dump or _fixture('compute-1-mpls.txt'),
+            'compute-2': _fixture('compute-2-nsh.txt')}
+
+
+def test_flow_paths_mpls():
+    assert verify.flow_paths('priority=1,mpls,mpls_label=511 actions=pop_mpls:0x0800') == set([(1, 255)])
+    assert verify.flow_paths('actions=push_mpls:0x8847,set_field:0x3fe->mpls_label') == set([(3, 254)])
+    assert verify.flow_paths('actions=push_mpls:0x8847,set_mpls_label(767)') == set([(2, 255)])
+
+
+def test_flow_paths_nsh():
+    assert verify.flow_paths('priority=1,nsh,nsh_spi=0x2,nsh_si=255 actions=decap()') == set([(2, 255)])
+    assert verify.flow_paths('priority=1,nsp=4,nsi=253 actions=output:3') == set([(4, 253)])
+    assert verify.flow_paths('priority=0 actions=NORMAL') == set()
+
+
+def test_classifier_tokens():
+    assert verify.classifier_tokens(dict(ethertype='IPv4', protocol='udp',
+                                         destination_ip_prefix='10.1.0.5/32')) == ['nw_dst=10.1.0.5', 'udp']
+    assert verify.classifier_tokens(dict(ethertype='IPv6', protocol='tcp',
+                                         source_ip_prefix='2001:db8::/64')) == ['ipv6_src=2001:db8::/64', 'tcp6']
+
+
+def test_scan_dump():
+    classifiers = [('fc1', ['nw_src=10.0.0.0/24', 'tcp'], (1, 255)),
+                   ('fc3', ['nw_src=10.9.0.0/24', 'tcp'], (1, 255))]
+    paths, found = verify.scan_dump(_fixture('compute-1-mpls.txt'), classifiers)
+    assert paths == set([(1, 255), (3, 255)])
+    assert found == set(['fc1'])
+
+
+def test_verify():
+    result = verify.verify(snapshot_load(_fixture('snapshot.jsonl')), _dumps())
+
+    assert result['missing_hops'] == 1
+    assert result['port_chains']['pc1']['missing_hops'] == []
+    assert result['port_chains']['pc2']['missing_hops'] == [
+        dict(hop=0, port_pair_group='ppg2', host='compute-2', path_id=2, service_index=255)]
+
+    assert result['missing_classifiers'] == 1
+    assert result['port_chains']['pc1']['missing_classifiers'] == []
+    assert result['port_chains']['pc2']['missing_classifiers'] == [
+        dict(flow_classifier='fc2', host='compute-2')]
+
+    assert result['stale'] == {'compute-1': [[3, 255]], 'compute-2': [[1, 252]]}
+    assert result['unverified_hosts'] == ['compute-3']
+
+
+def test_verify_gzip(tmpdir):
+    path = str(tmpdir.join('compute-1-mpls.txt.gz'))
+    with open(_fixture('compute-1-mpls.txt'), 'rb') as src:
+        with gzip.open(path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+    topology = snapshot_load(_fixture('snapshot.jsonl'))
+    assert verify.verify(topology, _dumps(path)) == verify.verify(topology, _dumps())